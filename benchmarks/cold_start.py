@@ -0,0 +1,113 @@
+######################################################################################
+#
+#   This file is part of PyService.
+#
+#   PyService is free software: you can redistribute it and/or modify it under the
+#   terms of the GNU General Public License as published by the Free Software
+#   Foundation, version 2.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#   FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#   details.
+#
+#   You should have received a copy of the GNU General Public License along with
+#   this program; if not, write to the Free Software Foundation, Inc., 51
+#   Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#   Copyright: Swen Kooij (Photonios) <photonios@outlook.com>
+#
+#####################################################################################
+
+"""Measures how long a service takes to start, from its script and from a bundle.
+
+Builds the same bundle `--install` builds when `bundle_on_install` is enabled,
+and then repeatedly runs a command against both the script and the bundle, each
+time in a fresh interpreter. By default the command is `--stop` of a service
+that is not running, which imports everything and constructs the service, but
+does nothing else: the cost every `--start`, `--stop` and restart pays up front.
+
+With `--cold`, every run gets an empty bytecode cache (PYTHONPYCACHEPREFIX), as
+after a deploy or when the cache directories are not writable. The script then
+has to compile all of its modules, the bundle only the standard library.
+
+Usage:
+    python benchmarks/cold_start.py SCRIPT [--runs 20] [--command --stop] [--cold]
+                                    [--output results.json]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pyservice.bundle import build_bundle
+
+def measure(path, command, runs, cold):
+    """Runs `python path command` the specified amount of times and returns the durations."""
+
+    durations = []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as cache:
+            environment = dict(os.environ)
+            if cold:
+                environment['PYTHONPYCACHEPREFIX'] = cache
+
+            start = time.perf_counter()
+            subprocess.run([sys.executable, path, command], env=environment,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            durations.append(time.perf_counter() - start)
+
+    return durations
+
+def summarize(name, durations):
+    """Summarizes the durations of a set of runs, in milliseconds."""
+
+    return {
+        'name': name,
+        'runs': len(durations),
+        'median_ms': statistics.median(durations) * 1000,
+        'mean_ms': statistics.mean(durations) * 1000,
+        'min_ms': min(durations) * 1000,
+        'max_ms': max(durations) * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('script')
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--command', default='--stop')
+    parser.add_argument('--cold', action='store_true')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    script = os.path.abspath(args.script)
+
+    with tempfile.TemporaryDirectory() as directory:
+        bundle = os.path.join(directory, 'service.pyz')
+        modules = build_bundle(script, bundle)
+        print('Bundled %d modules' % len(modules))
+
+        # One untimed run each, so both start with the same OS caches
+        measure(script, args.command, 1, args.cold)
+        measure(bundle, args.command, 1, args.cold)
+
+        results = [summarize('script', measure(script, args.command, args.runs, args.cold)),
+                   summarize('bundle', measure(bundle, args.command, args.runs, args.cold))]
+
+    for result in results:
+        print('%(name)-8s median %(median_ms)7.1f ms   mean %(mean_ms)7.1f ms   '
+              'min %(min_ms)7.1f ms   max %(max_ms)7.1f ms' % result)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'arguments': vars(args), 'modules': modules, 'results': results}, file, indent=4)
+
+if __name__ == '__main__':
+    main()
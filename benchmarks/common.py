@@ -0,0 +1,45 @@
+######################################################################################
+#
+#   This file is part of PyService.
+#
+#   PyService is free software: you can redistribute it and/or modify it under the
+#   terms of the GNU General Public License as published by the Free Software
+#   Foundation, version 2.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#   FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#   details.
+#
+#   You should have received a copy of the GNU General Public License along with
+#   this program; if not, write to the Free Software Foundation, Inc., 51
+#   Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#   Copyright: Swen Kooij (Photonios) <photonios@outlook.com>
+#
+#####################################################################################
+
+"""Helpers shared by the benchmarks."""
+
+import socket
+
+def free_port():
+    """Finds a TCP port on the loopback interface that is not in use."""
+
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+def percentile(values, fraction):
+    """Gets the value at the specified fraction (0.0 - 1.0) of the sorted values.
+
+    Returns:
+        The value, or None when there are no values.
+    """
+
+    if not values:
+        return None
+
+    return values[min(int(len(values) * fraction), len(values) - 1)]
@@ -0,0 +1,221 @@
+######################################################################################
+#
+#   This file is part of PyService.
+#
+#   PyService is free software: you can redistribute it and/or modify it under the
+#   terms of the GNU General Public License as published by the Free Software
+#   Foundation, version 2.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#   FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#   details.
+#
+#   You should have received a copy of the GNU General Public License along with
+#   this program; if not, write to the Free Software Foundation, Inc., 51
+#   Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#   Copyright: Swen Kooij (Photonios) <photonios@outlook.com>
+#
+#####################################################################################
+
+"""Compares tail latency of kernel balancing and supervisor dispatch on a skewed workload.
+
+Starts the service below twice, once with the listening socket shared by all
+workers (the kernel decides which worker accepts a connection) and once in
+dispatch mode (the supervisor passes each connection to the least loaded worker).
+Both are driven with the same closed-loop load, in which a small fraction of the
+requests is much slower than the rest.
+
+The workers behave like an event loop: they eagerly take every connection that
+is waiting and then process their queue one request at a time. This is what makes
+kernel balancing skewed, a worker that just finished a slow request takes the
+whole accept backlog, while the other workers sit idle.
+
+Usage:
+    python benchmarks/dispatch.py [--workers 4] [--concurrency 32] [--requests 4000]
+                                  [--slow-ratio 0.05] [--slow-ms 50] [--fast-ms 1]
+                                  [--output results.json]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import signal
+import socket
+import argparse
+import selectors
+import threading
+import subprocess
+import collections
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pyservice
+from common import free_port, percentile
+
+class SkewedService(pyservice.PyService):
+    """Service that sleeps for the amount of milliseconds in each request."""
+
+    min_workers = int(os.environ.get('BENCH_WORKERS', '4'))
+    max_workers = min_workers
+    listen = [('127.0.0.1', int(os.environ.get('BENCH_PORT', '0')))]
+    dispatch = os.environ.get('BENCH_MODE') == 'dispatch'
+
+    def started(self):
+        selector = selectors.DefaultSelector()
+        for sock in self.sockets:
+            selector.register(sock, selectors.EVENT_READ)
+        if self.dispatch_channel:
+            selector.register(self.dispatch_channel, selectors.EVENT_READ)
+
+        queue = collections.deque()
+        while True:
+            for key, events in selector.select(0 if queue else None):
+                queue.extend(self._take(key.fileobj))
+
+            if queue:
+                self._handle(queue.popleft())
+
+    def _take(self, source):
+        """Takes all connections that are waiting on a listening socket or the dispatch channel."""
+
+        connections = []
+        while True:
+            if source is self.dispatch_channel:
+                received = self.receive_connection()
+                if not received:
+                    return connections
+                connection = received[0]
+            else:
+                try:
+                    connection, address = source.accept()
+                except BlockingIOError:
+                    return connections
+
+            self.request_started()
+            connections.append(connection)
+
+    def _handle(self, connection):
+        """Reads the cost of the request, sleeps and responds."""
+
+        connection.setblocking(True)
+        try:
+            request = connection.makefile('rb').readline()
+            time.sleep(float(request) / 1000)
+            connection.sendall(b'ok\n')
+        except (OSError, ValueError):
+            pass
+        finally:
+            connection.close()
+            self.request_finished()
+
+    def stopped(self):
+        sys.exit(0)
+
+    def installed(self):
+        pass
+
+    def uninstalled(self):
+        pass
+
+def request(port, cost):
+    """Sends a single request and returns its latency in seconds."""
+
+    start = time.perf_counter()
+    connection = socket.create_connection(('127.0.0.1', port))
+    try:
+        connection.sendall(b'%f\n' % cost)
+        connection.makefile('rb').readline()
+    finally:
+        connection.close()
+    return time.perf_counter() - start
+
+def run(mode, args):
+    """Starts the service in the specified mode, drives it and returns the results."""
+
+    port = free_port()
+    environment = dict(os.environ, BENCH_MODE=mode, BENCH_PORT=str(port),
+                       BENCH_WORKERS=str(args.workers))
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--run'], env=environment)
+
+    try:
+        # Wait until the service accepts connections
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                request(port, 0)
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+        # Every mode gets exactly the same sequence of requests
+        generator = random.Random(args.seed)
+        costs = [args.slow_ms if generator.random() < args.slow_ratio else args.fast_ms
+                 for _ in range(args.requests)]
+
+        latencies = []
+        lock = threading.Lock()
+
+        def client():
+            while True:
+                with lock:
+                    if not costs:
+                        return
+                    cost = costs.pop()
+
+                latency = request(port, cost)
+                with lock:
+                    latencies.append(latency)
+
+        start = time.perf_counter()
+        clients = [threading.Thread(target=client) for _ in range(args.concurrency)]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        duration = time.perf_counter() - start
+
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+
+    latencies.sort()
+    return {
+        'mode': mode,
+        'requests_per_second': len(latencies) / duration,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'p999_ms': percentile(latencies, 0.999) * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=4000)
+    parser.add_argument('--slow-ratio', type=float, default=0.05)
+    parser.add_argument('--slow-ms', type=float, default=50)
+    parser.add_argument('--fast-ms', type=float, default=1)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    results = [run(mode, args) for mode in ('kernel', 'dispatch')]
+    for result in results:
+        print('%(mode)-10s %(requests_per_second)8.1f req/s   p50 %(p50_ms)7.2f ms   '
+              'p99 %(p99_ms)7.2f ms   p99.9 %(p999_ms)7.2f ms' % result)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'arguments': vars(args), 'results': results}, file, indent=4)
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['--run']:
+        SkewedService('dispatch-benchmark', 'Skewed workload for the dispatch benchmark', False)
+    else:
+        main()
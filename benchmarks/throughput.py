@@ -0,0 +1,328 @@
+######################################################################################
+#
+#   This file is part of PyService.
+#
+#   PyService is free software: you can redistribute it and/or modify it under the
+#   terms of the GNU General Public License as published by the Free Software
+#   Foundation, version 2.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#   FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#   details.
+#
+#   You should have received a copy of the GNU General Public License along with
+#   this program; if not, write to the Free Software Foundation, Inc., 51
+#   Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#   Copyright: Swen Kooij (Photonios) <photonios@outlook.com>
+#
+#####################################################################################
+
+"""Measures how much the example Tornado service (main.py) serves in each execution mode.
+
+Starts `MyService` from main.py in every mode, drives `TestHandler` over loopback
+and reports the throughput and the latency percentiles of each run:
+
+* run: a single process, started with `--run`
+* daemon: a single process, daemonized with `--start` (and stopped with `--stop`)
+* shared: a supervisor with `--workers` workers sharing its listening socket
+* dispatch: a supervisor with `--workers` workers, passing each connection to
+  the least loaded worker
+
+Every mode is driven with a closed-loop load at each of the `--concurrency`
+levels (every connection sends its next request as soon as the previous one
+was answered) and an open-loop load at each of the `--rates` (requests arrive
+as a Poisson process, whether or not the service keeps up). Open-loop latency
+is measured from when a request was due, not from when a connection was free to
+send it, so queueing in an overloaded service shows up in the percentiles.
+
+The load is generated by `--clients` processes, each with its share of the
+connections and of the rate, using persistent HTTP/1.1 connections.
+
+Usage:
+    python benchmarks/throughput.py [--modes run,daemon,shared,dispatch] [--workers 4]
+                                    [--concurrency 1,16,64] [--rates 500,2000]
+                                    [--duration 5] [--warmup 1] [--clients 2]
+                                    [--output results.json]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import signal
+import socket
+import argparse
+import selectors
+import subprocess
+import collections
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from main import MyService
+from common import free_port, percentile
+
+REQUEST = b'GET / HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n'
+
+# Workers and the option the service is started with, for each mode
+MODES = collections.OrderedDict([
+    ('run', (False, '--run')),
+    ('daemon', (False, '--start')),
+    ('shared', (True, '--run')),
+    ('dispatch', (True, '--run'))
+])
+
+class ThroughputService(MyService):
+    """The example service, in the mode the benchmark passed through the environment."""
+
+    port = int(os.environ.get('BENCH_PORT', '1337'))
+    min_workers = int(os.environ.get('BENCH_WORKERS', '1'))
+    max_workers = min_workers
+    listen = [('127.0.0.1', port)] if min_workers > 1 else []
+    dispatch = os.environ.get('BENCH_MODE') == 'dispatch'
+
+class Connection(object):
+    """A persistent connection to the service, with the request it is waiting on."""
+
+    def __init__(self, port):
+        self.sock = socket.create_connection(('127.0.0.1', port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.buffer = b''
+        self.started = None
+
+    def send(self, started):
+        """Sends a request that was due at the specified time."""
+
+        self.started = started
+        self.sock.sendall(REQUEST)
+
+    def receive(self):
+        """Reads what arrived of the response.
+
+        Returns:
+            True when the response is complete, false when more is coming.
+
+        Raises:
+            ConnectionError when the service closed the connection.
+        """
+
+        data = self.sock.recv(65536)
+        if not data:
+            raise ConnectionError('Connection closed by the service')
+
+        self.buffer += data
+        end = self.buffer.find(b'\r\n\r\n')
+        if end < 0:
+            return False
+
+        length = 0
+        for line in self.buffer[:end].split(b'\r\n')[1:]:
+            name, value = line.split(b':', 1)
+            if name.strip().lower() == b'content-length':
+                length = int(value)
+
+        if len(self.buffer) < end + 4 + length:
+            return False
+
+        self.buffer = self.buffer[end + 4 + length:]
+        return True
+
+def drive(port, connections, rate, warmup, duration, seed):
+    """Drives the service from the current process.
+
+    Args:
+        port (int):
+            The port the service listens on.
+        connections (int):
+            The amount of connections to use.
+        rate (float):
+            The open-loop rate in requests per second, or None for a closed loop.
+        warmup (float):
+            Seconds to drive the service before measuring.
+        duration (float):
+            Seconds to measure.
+        seed (int):
+            Seed of the arrival times of the open-loop requests.
+
+    Returns:
+        A tuple of the latencies (seconds) of the requests that were due after
+        the warm-up, the amount of failed requests and the amount of requests
+        that were still due or waiting on a response at the end.
+    """
+
+    selector = selectors.DefaultSelector()
+    generator = random.Random(seed)
+    idle = collections.deque(Connection(port) for _ in range(connections))
+    due = collections.deque()
+    latencies = []
+    errors = 0
+
+    start = time.perf_counter()
+    measured = start + warmup
+    end = measured + duration
+    arrival = start
+
+    while True:
+        now = time.perf_counter()
+        if now >= end:
+            break
+
+        if rate:
+            while arrival <= now:
+                due.append(arrival)
+                arrival += generator.expovariate(rate)
+
+        while idle and (due or not rate):
+            connection = idle.popleft()
+            connection.send(due.popleft() if rate else now)
+            selector.register(connection.sock, selectors.EVENT_READ, connection)
+
+        timeout = min(arrival, end) - now if rate else end - now
+        for key, events in selector.select(max(timeout, 0)):
+            connection = key.data
+            try:
+                if not connection.receive():
+                    continue
+            except OSError:
+                errors += 1
+                selector.unregister(connection.sock)
+                connection.sock.close()
+                idle.append(Connection(port))
+                continue
+
+            if connection.started >= measured:
+                latencies.append(time.perf_counter() - connection.started)
+
+            selector.unregister(connection.sock)
+            idle.append(connection)
+
+    unfinished = len(due) + len(selector.get_map())
+    for connection in idle:
+        connection.sock.close()
+    for key in list(selector.get_map().values()):
+        key.fileobj.close()
+    selector.close()
+
+    return latencies, errors, unfinished
+
+def wait_until_serving(port, timeout=10.0):
+    """Waits until the service answers a request."""
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            connection = Connection(port)
+            connection.send(0)
+            while not connection.receive():
+                pass
+            connection.sock.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+def measure(mode, port, concurrency, rate, args):
+    """Drives the running service with one load and returns the results."""
+
+    clients = min(args.clients, concurrency)
+    shares = [(port, concurrency // clients + (index < concurrency % clients),
+               rate / clients if rate else None, args.warmup, args.duration, args.seed + index)
+              for index in range(clients)]
+
+    with multiprocessing.Pool(clients) as pool:
+        results = pool.starmap(drive, shares)
+
+    latencies = sorted(latency for result in results for latency in result[0])
+    milliseconds = lambda value: value * 1000 if value is not None else None
+
+    return {
+        'mode': mode,
+        'load': 'open' if rate else 'closed',
+        'concurrency': concurrency,
+        'rate': rate,
+        'requests': len(latencies),
+        'errors': sum(result[1] for result in results),
+        'unfinished': sum(result[2] for result in results),
+        'requests_per_second': len(latencies) / args.duration,
+        'p50_ms': milliseconds(percentile(latencies, 0.50)),
+        'p99_ms': milliseconds(percentile(latencies, 0.99)),
+        'p999_ms': milliseconds(percentile(latencies, 0.999)),
+    }
+
+def run(mode, args):
+    """Starts the service in the specified mode, drives it with every load and stops it."""
+
+    workers, option = MODES[mode]
+    port = free_port()
+    environment = dict(os.environ, BENCH_MODE=mode, BENCH_PORT=str(port),
+                       BENCH_WORKERS=str(args.workers if workers else 1))
+    command = [sys.executable, os.path.abspath(__file__)]
+    server = subprocess.Popen(command + [option], env=environment)
+
+    results = []
+    try:
+        wait_until_serving(port)
+
+        for concurrency in args.concurrency:
+            results.append(measure(mode, port, concurrency, None, args))
+        for rate in args.rates:
+            results.append(measure(mode, port, max(args.concurrency), rate, args))
+
+    finally:
+        # A daemonized service is no child of the benchmark, it is stopped
+        # the way it was started
+        if option == '--start':
+            subprocess.call(command + ['--stop'], env=environment)
+            server.wait()
+        else:
+            server.send_signal(signal.SIGTERM)
+            server.wait()
+
+    return results
+
+def numbers(kind):
+    """Creates an argument type for a comma separated list of numbers."""
+
+    return lambda value: [kind(number) for number in value.split(',') if number]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--modes', type=lambda value: value.split(','), default=list(MODES))
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--concurrency', type=numbers(int), default=[1, 16, 64])
+    parser.add_argument('--rates', type=numbers(float), default=[500, 2000])
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--warmup', type=float, default=1)
+    parser.add_argument('--clients', type=int, default=max((os.cpu_count() or 2) // 2, 1))
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    for mode in args.modes:
+        if mode not in MODES:
+            parser.error('unknown mode `%s`, choose from %s' % (mode, ', '.join(MODES)))
+
+    results = []
+    for mode in args.modes:
+        for result in run(mode, args):
+            results.append(result)
+            load = 'rate %g/s' % result['rate'] if result['rate'] else 'concurrency %d' % result['concurrency']
+            print('%-8s %-18s %8.1f req/s   p50 %s   p99 %s   p99.9 %s   errors %d   unfinished %d' % (
+                mode, load, result['requests_per_second'],
+                *('%7.2f ms' % result[key] if result[key] is not None else '      - ms'
+                  for key in ('p50_ms', 'p99_ms', 'p999_ms')),
+                result['errors'], result['unfinished']))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'arguments': vars(args), 'results': results}, file, indent=4)
+
+if __name__ == '__main__':
+    if sys.argv[1:] in (['--run'], ['--start'], ['--stop']):
+        ThroughputService('throughput-benchmark', 'The example service, for the throughput benchmark', False)
+    else:
+        main()
@@ -22,6 +22,8 @@
 import pyservice
 import tornado.ioloop
 import tornado.web
+import tornado.httpserver
+import tornado.iostream
 import sys
 
 class TestHandler(tornado.web.RequestHandler):
@@ -29,13 +31,36 @@ class TestHandler(tornado.web.RequestHandler):
         self.write('Hello world!')
 
 class MyService(pyservice.PyService):
+    port = 1337
+
     def started(self):
         application = tornado.web.Application([
             (r'/', TestHandler)
         ])
 
-        application.listen(1337)
-        tornado.ioloop.IOLoop.instance().start()
+        server = tornado.httpserver.HTTPServer(application)
+        ioloop = tornado.ioloop.IOLoop.instance()
+
+        # Under a supervisor, the workers either share the listening sockets
+        # of the supervisor or get the connections it dispatches to them
+        if self.sockets:
+            server.add_sockets(self.sockets)
+        elif self.dispatch_channel:
+            ioloop.add_handler(self.dispatch_channel, lambda fd, events: self.receive(server), ioloop.READ)
+        else:
+            server.listen(self.port)
+
+        ioloop.start()
+
+    def receive(self, server):
+        while True:
+            received = self.receive_connection()
+            if not received:
+                return
+
+            connection, address = received
+            connection.setblocking(False)
+            server.handle_stream(tornado.iostream.IOStream(connection), address)
 
     def stopped(self):
         sys.exit(0)
@@ -20,4 +20,8 @@
 #####################################################################################
 
 from .service import PyService
-from .exceptions import *
\ No newline at end of file
+from .exceptions import *
+from .autoscaler import Autoscaler
+from .state import StateStore
+from .subprocesses import SubprocessPool, ManagedProcess
+from .admission import AdmissionController, FixedLimit, AIMDLimit, GradientLimit
@@ -0,0 +1,403 @@
+######################################################################################
+#
+#   This file is part of PyService.
+#
+#   PyService is free software: you can redistribute it and/or modify it under the
+#   terms of the GNU General Public License as published by the Free Software
+#   Foundation, version 2.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#   FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#   details.
+#
+#   You should have received a copy of the GNU General Public License along with
+#   this program; if not, write to the Free Software Foundation, Inc., 51
+#   Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#   Copyright: Swen Kooij (Photonios) <photonios@outlook.com>
+#
+#####################################################################################
+
+import math
+import time
+import functools
+import threading
+import collections
+from .exceptions import OverloadedError
+
+class FixedLimit(object):
+    """Concurrency limit that never changes.
+
+    """
+
+    def __init__(self, limit):
+        """Initializes a new instance of the FixedLimit class.
+
+        Args:
+            limit (int):
+                The maximum amount of requests that are handled concurrently.
+        """
+
+        self.limit = limit
+
+    def update(self, latency, in_flight, dropped):
+        """Called after every admitted request finished, with the observed latency.
+
+        Args:
+            latency (float):
+                The amount of seconds it took to handle the request.
+            in_flight (int):
+                The amount of requests that were in flight when the request finished.
+            dropped (bool):
+                True when the request failed in a way that indicates overload.
+        """
+
+        pass
+
+class AIMDLimit(FixedLimit):
+    """Concurrency limit with additive increase and multiplicative decrease.
+
+    The limit grows by one for every request that finished within `latency_threshold`
+    while the limit was being used, and is multiplied by `backoff` for every request
+    that was slower or dropped.
+
+    """
+
+    def __init__(self, initial=20, minimum=1, maximum=1000, backoff=0.9, latency_threshold=1.0):
+        """Initializes a new instance of the AIMDLimit class.
+
+        Args:
+            initial (int):
+                The limit to start with.
+            minimum (int):
+                The limit never drops below this.
+            maximum (int):
+                The limit never grows above this.
+            backoff (float):
+                Factor (0.0 - 1.0) the limit is multiplied by on overload.
+            latency_threshold (float):
+                Requests slower than this amount of seconds are treated as overload.
+        """
+
+        super().__init__(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.latency_threshold = latency_threshold
+        self._limit = float(initial)
+
+    def update(self, latency, in_flight, dropped):
+        if dropped or latency > self.latency_threshold:
+            self._limit = max(self.minimum, self._limit * self.backoff)
+
+        # Only grow when the limit is actually being used, an idle
+        # service says nothing about how much more it can handle
+        elif in_flight * 2 >= self.limit:
+            self._limit = min(self.maximum, self._limit + 1)
+
+        self.limit = int(self._limit)
+
+class GradientLimit(FixedLimit):
+    """Concurrency limit that follows the gradient of the observed latency.
+
+    A long term average of the latency is compared to the latest latency. While
+    the latency stays near the long term average, the limit grows by a headroom of
+    roughly the square root of the limit. When the latency rises above the average,
+    queueing is happening somewhere and the limit shrinks proportionally.
+
+    """
+
+    def __init__(self, initial=20, minimum=1, maximum=1000, smoothing=0.2, tolerance=1.5, window=600):
+        """Initializes a new instance of the GradientLimit class.
+
+        Args:
+            initial (int):
+                The limit to start with.
+            minimum (int):
+                The limit never drops below this.
+            maximum (int):
+                The limit never grows above this.
+            smoothing (float):
+                Weight (0.0 - 1.0) of a new estimate in the limit.
+            tolerance (float):
+                How much slower than the long term average the latency may get
+                before the limit starts shrinking.
+            window (int):
+                Amount of samples the long term average of the latency spans.
+        """
+
+        super().__init__(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.smoothing = smoothing
+        self.tolerance = tolerance
+        self.window = window
+        self._limit = float(initial)
+        self._long_latency = None
+
+    def update(self, latency, in_flight, dropped):
+        if self._long_latency is None:
+            self._long_latency = latency
+        else:
+            self._long_latency += (latency - self._long_latency) / self.window
+
+        # Do not grow when the limit is not being used
+        if in_flight * 2 < self.limit and not dropped:
+            return
+
+        gradient = 0.5 if dropped else max(0.5, min(1.0, self.tolerance * self._long_latency / max(latency, 1e-9)))
+        estimate = self._limit * gradient + math.sqrt(self._limit)
+
+        self._limit = self._limit * (1 - self.smoothing) + estimate * self.smoothing
+        self._limit = max(self.minimum, min(self.maximum, self._limit))
+        self.limit = int(self._limit)
+
+class AdmissionController(object):
+    """Limits the amount of requests a service handles concurrently.
+
+    Requests that arrive while the limit is reached wait in a bounded queue, in
+    order of arrival. Once the queue is full, or a request waited longer than
+    `queue_timeout`, the request is rejected right away with an OverloadedError,
+    instead of piling up and making every request slow.
+
+    Works for both threads and asyncio coroutines, see `wrap`.
+
+    """
+
+    def __init__(self, limit, max_queue=64, queue_timeout=1.0):
+        """Initializes a new instance of the AdmissionController class.
+
+        Args:
+            limit (FixedLimit):
+                The (adaptive) concurrency limit.
+            max_queue (int):
+                The maximum amount of requests waiting for admission.
+            queue_timeout (float):
+                The maximum amount of seconds a request waits for admission.
+        """
+
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self.in_flight = 0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+
+        self._lock = threading.Lock()
+        self._waiters = collections.deque()
+
+    @property
+    def waiting(self):
+        """The amount of requests currently waiting for admission."""
+
+        return len(self._waiters)
+
+    def stats(self):
+        """Gets the counters of this admission controller.
+
+        Returns:
+            A dictionary with the current limit, the amount of requests in flight
+            and waiting, and the total amount of requests that were admitted,
+            had to wait in the queue and were rejected.
+        """
+
+        with self._lock:
+            return {
+                'limit': self.limit.limit,
+                'in_flight': self.in_flight,
+                'waiting': len(self._waiters),
+                'admitted': self.admitted,
+                'queued': self.queued,
+                'rejected': self.rejected
+            }
+
+    def acquire(self):
+        """Waits for admission of a request, from a thread.
+
+        Raises:
+            OverloadedError:
+                When the queue is full, or the request waited too long.
+        """
+
+        with self._lock:
+            if self._admit_now():
+                return
+
+            event = threading.Event()
+            self._enqueue(event)
+
+        if event.wait(self.queue_timeout):
+            return
+
+        self._expire(event)
+
+    async def acquire_async(self):
+        """Waits for admission of a request, from an asyncio coroutine.
+
+        Raises:
+            OverloadedError:
+                When the queue is full, or the request waited too long.
+        """
+
+        # Imported here, asyncio is expensive to import and not every
+        # service uses it, this keeps starting the service quick
+        import asyncio
+
+        with self._lock:
+            if self._admit_now():
+                return
+
+            future = asyncio.get_running_loop().create_future()
+            self._enqueue(future)
+
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._expire(future)
+        except asyncio.CancelledError:
+            self._cancel(future)
+            raise
+
+    def release(self, latency, dropped=False):
+        """Ends an admitted request and hands its slot to the next waiting request.
+
+        Args:
+            latency (float):
+                The amount of seconds it took to handle the request.
+            dropped (bool):
+                True when the request failed in a way that indicates overload.
+        """
+
+        with self._lock:
+            self.limit.update(latency, self.in_flight, dropped)
+            self.in_flight -= 1
+            self._admit_waiting()
+
+    def wrap(self, handler):
+        """Decorates a handler, so every call to it goes through admission control.
+
+        Works for both regular functions and coroutine functions. Calls that are
+        not admitted raise an OverloadedError without calling the handler.
+
+        Args:
+            handler (callable):
+                The handler to wrap.
+
+        Returns:
+            The wrapped handler.
+        """
+
+        import inspect
+
+        if inspect.iscoroutinefunction(handler):
+            @functools.wraps(handler)
+            async def wrapped(*args, **kwargs):
+                await self.acquire_async()
+                start = time.monotonic()
+                try:
+                    return await handler(*args, **kwargs)
+                finally:
+                    self.release(time.monotonic() - start)
+
+            return wrapped
+
+        @functools.wraps(handler)
+        def wrapped(*args, **kwargs):
+            self.acquire()
+            start = time.monotonic()
+            try:
+                return handler(*args, **kwargs)
+            finally:
+                self.release(time.monotonic() - start)
+
+        return wrapped
+
+    def _admit_now(self):
+        """Admits a request right away when below the limit and nobody is waiting.
+
+        Must be called with the lock held.
+
+        Returns:
+            True when the request was admitted.
+        """
+
+        if self._waiters or self.in_flight >= self.limit.limit:
+            return False
+
+        self.in_flight += 1
+        self.admitted += 1
+        return True
+
+    def _enqueue(self, waiter):
+        """Puts a request in the queue, or rejects it when the queue is full.
+
+        Must be called with the lock held.
+        """
+
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise OverloadedError('Overloaded, %d requests in flight and %d waiting' %
+                                  (self.in_flight, len(self._waiters)))
+
+        self.queued += 1
+        self._waiters.append(waiter)
+
+    def _admit_waiting(self):
+        """Admits waiting requests while below the limit. Must be called with the lock held."""
+
+        # The limit might have grown, so admit as many as possible
+        while self._waiters and self.in_flight < self.limit.limit:
+            self._grant(self._waiters.popleft())
+
+    def _grant(self, waiter):
+        """Admits a waiting request. Must be called with the lock held."""
+
+        self.in_flight += 1
+        self.admitted += 1
+
+        if isinstance(waiter, threading.Event):
+            waiter.set()
+        else:
+            waiter.get_loop().call_soon_threadsafe(self._resolve, waiter)
+
+    def _resolve(self, future):
+        """Wakes up a waiting coroutine that was admitted, on its own event loop."""
+
+        if not future.done():
+            future.set_result(None)
+
+    def _cancel(self, waiter):
+        """Forgets a waiting request that was cancelled.
+
+        When the request was admitted right before it was cancelled, its slot is
+        handed to the next waiting request. The request never ran, so the limit
+        does not learn anything from it.
+        """
+
+        with self._lock:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+                return
+
+            self.in_flight -= 1
+            self._admit_waiting()
+
+    def _expire(self, waiter):
+        """Rejects a request that waited too long for admission.
+
+        Raises:
+            OverloadedError:
+                Unless the request was admitted right before it expired.
+        """
+
+        with self._lock:
+            if waiter not in self._waiters:
+                return
+
+            self._waiters.remove(waiter)
+            self.rejected += 1
+
+        raise OverloadedError('Overloaded, waited %.2f seconds for admission' % self.queue_timeout)
@@ -0,0 +1,161 @@
+######################################################################################
+#
+#   This file is part of PyService.
+#
+#   PyService is free software: you can redistribute it and/or modify it under the
+#   terms of the GNU General Public License as published by the Free Software
+#   Foundation, version 2.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#   FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#   details.
+#
+#   You should have received a copy of the GNU General Public License along with
+#   this program; if not, write to the Free Software Foundation, Inc., 51
+#   Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#   Copyright: Swen Kooij (Photonios) <photonios@outlook.com>
+#
+#####################################################################################
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Autoscaler(object):
+    """Decides how many worker processes a supervised service should be running.
+
+    Every time the supervisor samples its workers, it feeds the samples to
+    `decide`, which returns the number of workers that should be running. Three
+    signals are taken into account:
+
+    * The CPU utilisation of each worker (0.0 - 1.0 per worker).
+    * The number of connections waiting in the accept backlog of the listening sockets.
+    * The queue length each worker reported through `PyService.report_queue_length`.
+
+    To prevent flapping, the thresholds for scaling up and scaling down are apart
+    from each other (hysteresis), a condition has to hold for several consecutive
+    samples before it is acted upon, and after every scaling action there is a
+    cooldown period in which no other action is taken.
+
+    """
+
+    def __init__(self, min_workers, max_workers,
+                 scale_up_cpu=0.75, scale_down_cpu=0.25,
+                 scale_up_backlog=8, scale_up_queue=16, scale_down_queue=1,
+                 scale_up_samples=3, scale_down_samples=30,
+                 scale_up_cooldown=10.0, scale_down_cooldown=60.0):
+        """Initializes a new instance of the Autoscaler class.
+
+        Args:
+            min_workers (int):
+                The minimum amount of workers that should be running.
+            max_workers (int):
+                The maximum amount of workers that should be running.
+            scale_up_cpu (float):
+                Average CPU utilisation per worker above which to scale up.
+            scale_down_cpu (float):
+                Average CPU utilisation per worker below which to scale down.
+            scale_up_backlog (int):
+                Accept backlog depth above which to scale up.
+            scale_up_queue (float):
+                Average reported queue length per worker above which to scale up.
+            scale_down_queue (float):
+                Average reported queue length per worker below which to scale down.
+            scale_up_samples (int):
+                Amount of consecutive samples that have to be over the scale up
+                thresholds before scaling up.
+            scale_down_samples (int):
+                Amount of consecutive samples that have to be under the scale down
+                thresholds before scaling down.
+            scale_up_cooldown (float):
+                Seconds to wait after any scaling action before scaling up again.
+            scale_down_cooldown (float):
+                Seconds to wait after any scaling action before scaling down again.
+        """
+
+        if min_workers < 0 or max_workers < 1 or min_workers > max_workers:
+            raise ValueError('Invalid worker bounds: %d - %d' % (min_workers, max_workers))
+
+        if scale_down_cpu >= scale_up_cpu or scale_down_queue >= scale_up_queue:
+            raise ValueError('Scale down thresholds must be lower than the scale up thresholds')
+
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.scale_up_cpu = scale_up_cpu
+        self.scale_down_cpu = scale_down_cpu
+        self.scale_up_backlog = scale_up_backlog
+        self.scale_up_queue = scale_up_queue
+        self.scale_down_queue = scale_down_queue
+        self.scale_up_samples = scale_up_samples
+        self.scale_down_samples = scale_down_samples
+        self.scale_up_cooldown = scale_up_cooldown
+        self.scale_down_cooldown = scale_down_cooldown
+
+        self._over = 0
+        self._under = 0
+        self._last_action = None
+
+    def decide(self, now, workers, cpu, backlog, queue_length):
+        """Decides how many workers should be running, based on the latest sample.
+
+        Args:
+            now (float):
+                Monotonic timestamp of the sample.
+            workers (int):
+                The amount of workers currently running (not counting draining workers).
+            cpu (float):
+                Average CPU utilisation per worker.
+            backlog (int):
+                Total amount of connections waiting in the accept backlog.
+            queue_length (float):
+                Average reported queue length per worker.
+
+        Returns:
+            The amount of workers that should be running.
+        """
+
+        # Never go outside the configured bounds, regardless of load
+        if workers < self.min_workers:
+            return self._scale(now, workers, self.min_workers, 'below minimum', cpu, backlog, queue_length)
+        if workers > self.max_workers:
+            return self._scale(now, workers, self.max_workers, 'above maximum', cpu, backlog, queue_length)
+
+        over = cpu > self.scale_up_cpu or backlog > self.scale_up_backlog or queue_length > self.scale_up_queue
+        under = cpu < self.scale_down_cpu and backlog == 0 and queue_length < self.scale_down_queue
+
+        # Only count consecutive samples, a single sample in the other
+        # direction resets the count
+        self._over = self._over + 1 if over else 0
+        self._under = self._under + 1 if under else 0
+
+        if self._over >= self.scale_up_samples and workers < self.max_workers:
+            if self._cooled_down(now, self.scale_up_cooldown):
+                return self._scale(now, workers, workers + 1, 'overloaded', cpu, backlog, queue_length)
+
+        if self._under >= self.scale_down_samples and workers > self.min_workers:
+            if self._cooled_down(now, self.scale_down_cooldown):
+                return self._scale(now, workers, workers - 1, 'underloaded', cpu, backlog, queue_length)
+
+        return workers
+
+    def _cooled_down(self, now, cooldown):
+        """Determines whether the cooldown period since the last scaling action has passed."""
+
+        return self._last_action is None or now - self._last_action >= cooldown
+
+    def _scale(self, now, workers, target, reason, cpu, backlog, queue_length):
+        """Records and logs a scaling action.
+
+        Returns:
+            The new target amount of workers.
+        """
+
+        logger.info('Scaling %d -> %d workers (%s): cpu=%.2f backlog=%d queue=%.1f',
+                    workers, target, reason, cpu, backlog, queue_length)
+
+        self._last_action = now
+        self._over = 0
+        self._under = 0
+        return target
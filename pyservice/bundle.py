@@ -0,0 +1,150 @@
+######################################################################################
+#
+#   This file is part of PyService.
+#
+#   PyService is free software: you can redistribute it and/or modify it under the
+#   terms of the GNU General Public License as published by the Free Software
+#   Foundation, version 2.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#   FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#   details.
+#
+#   You should have received a copy of the GNU General Public License along with
+#   this program; if not, write to the Free Software Foundation, Inc., 51
+#   Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#   Copyright: Swen Kooij (Photonios) <photonios@outlook.com>
+#
+#####################################################################################
+
+import os
+import sys
+import stat
+import marshal
+import zipfile
+import sysconfig
+import modulefinder
+import importlib.util
+
+def _classify(path):
+    """Determines where a module comes from, based on the path of its file.
+
+    Returns:
+        `stdlib`, `site` (third party packages) or `local`.
+    """
+
+    paths = sysconfig.get_paths()
+    path = os.path.realpath(path)
+
+    for key in ('purelib', 'platlib'):
+        if path.startswith(os.path.realpath(paths[key]) + os.sep):
+            return 'site'
+
+    for key in ('stdlib', 'platstdlib'):
+        if path.startswith(os.path.realpath(paths[key]) + os.sep):
+            return 'stdlib'
+
+    return 'local'
+
+def _compile(source_path):
+    """Compiles a source file to the contents of a .pyc file.
+
+    The .pyc is hash based and unchecked, so the import system never looks at
+    the source file again (it is not part of the bundle anyway).
+
+    Args:
+        source_path (str):
+            The path of the source file.
+
+    Returns:
+        The contents of the .pyc file.
+    """
+
+    with open(source_path, 'rb') as file:
+        source = file.read()
+
+    code = compile(source, source_path, 'exec', dont_inherit=True)
+
+    # Header: magic, flags (hash based, unchecked), source hash
+    return importlib.util.MAGIC_NUMBER + (1).to_bytes(4, 'little') + \
+        importlib.util.source_hash(source) + marshal.dumps(code)
+
+def find_modules(script_path):
+    """Finds the modules a script imports that are not part of the standard library.
+
+    Packages that contain extension modules (or that could not be found as a
+    source file) are left out, they cannot be imported from a zip file and keep
+    being imported from where they are installed.
+
+    Args:
+        script_path (str):
+            The path of the script.
+
+    Returns:
+        A dictionary that maps the names of modules to a tuple of the path of their
+        source file and whether the module is a package.
+    """
+
+    finder = modulefinder.ModuleFinder()
+    finder.run_script(script_path)
+
+    modules = {}
+    excluded = set()
+
+    for name, module in finder.modules.items():
+        if name == '__main__' or not module.__file__:
+            continue
+
+        if _classify(module.__file__) == 'stdlib':
+            continue
+
+        top_level = name.split('.')[0]
+        if not module.__file__.endswith('.py'):
+            excluded.add(top_level)
+            continue
+
+        modules[name] = (module.__file__, module.__path__ is not None)
+
+    return dict((name, module) for name, module in modules.items()
+                if name.split('.')[0] not in excluded)
+
+def build_bundle(script_path, bundle_path):
+    """Builds a zip application of a script and the modules it imports, as bytecode.
+
+    Starting the bundle does not search the file system for the bundled modules
+    and never compiles them, the bundle is the first entry on the import path.
+
+    Args:
+        script_path (str):
+            The path of the service script.
+        bundle_path (str):
+            The path to write the bundle to.
+
+    Returns:
+        The list of names of the modules in the bundle.
+    """
+
+    modules = find_modules(script_path)
+
+    os.makedirs(os.path.dirname(bundle_path), exist_ok=True)
+    temporary_path = bundle_path + '.tmp'
+
+    with open(temporary_path, 'wb') as file:
+        file.write(b'#!' + sys.executable.encode() + b'\n')
+
+        # Stored instead of compressed, decompressing would cost start time
+        with zipfile.ZipFile(file, 'w', zipfile.ZIP_STORED) as bundle:
+            bundle.writestr('__main__.pyc', _compile(script_path))
+
+            for name, (path, is_package) in sorted(modules.items()):
+                archive_name = name.replace('.', '/')
+                archive_name += '/__init__.pyc' if is_package else '.pyc'
+                bundle.writestr(archive_name, _compile(path))
+
+    mode = os.stat(temporary_path).st_mode
+    os.chmod(temporary_path, mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    os.replace(temporary_path, bundle_path)
+
+    return sorted(modules)
@@ -0,0 +1,307 @@
+######################################################################################
+#
+#   This file is part of PyService.
+#
+#   PyService is free software: you can redistribute it and/or modify it under the
+#   terms of the GNU General Public License as published by the Free Software
+#   Foundation, version 2.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#   FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#   details.
+#
+#   You should have received a copy of the GNU General Public License along with
+#   this program; if not, write to the Free Software Foundation, Inc., 51
+#   Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#   Copyright: Swen Kooij (Photonios) <photonios@outlook.com>
+#
+#####################################################################################
+
+import os
+import json
+import socket
+import logging
+import selectors
+import threading
+
+logger = logging.getLogger(__name__)
+
+class JsonChannel(object):
+    """Exchanges JSON messages over a stream socket, one message per line.
+
+    Reading is non-blocking and driven by the owner of the socket, which calls
+    `handle_readable` whenever the socket is readable.
+
+    """
+
+    def __init__(self, sock, on_message, on_close=None):
+        """Initializes a new instance of the JsonChannel class.
+
+        Args:
+            sock (socket.socket):
+                The connected stream socket.
+            on_message (callable):
+                Called with this channel and every message that is received.
+            on_close (callable):
+                Called with this channel when the peer closed the connection.
+        """
+
+        self.sock = sock
+        self.on_message = on_message
+        self.on_close = on_close
+        self.closed = False
+        self._buffer = b''
+
+        self.sock.setblocking(False)
+
+    def fileno(self):
+        """Gets the file descriptor of the socket, so the channel can be used in selectors."""
+
+        return self.sock.fileno()
+
+    def send(self, message):
+        """Sends a message, silently dropped when the peer is gone."""
+
+        try:
+            self.sock.setblocking(True)
+            self.sock.sendall(json.dumps(message).encode() + b'\n')
+        except OSError:
+            pass
+        finally:
+            if not self.closed:
+                self.sock.setblocking(False)
+
+    def handle_readable(self):
+        """Reads what is available and passes every complete message on."""
+
+        try:
+            data = self.sock.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+
+        if not data:
+            self.close()
+            return
+
+        self._buffer += data
+        while b'\n' in self._buffer:
+            line, self._buffer = self._buffer.split(b'\n', 1)
+            try:
+                message = json.loads(line)
+            except ValueError:
+                logger.warning('Ignoring malformed control message')
+                continue
+
+            self.on_message(self, message)
+
+    def close(self):
+        """Closes the channel."""
+
+        if self.closed:
+            return
+
+        self.closed = True
+        if self.on_close:
+            self.on_close(self)
+
+        self.sock.close()
+
+class ControlServer(object):
+    """Accepts commands for a running service on a unix socket.
+
+    Every command is a JSON object with at least a `command` key. The handler
+    receives the command and a function to reply with, which may also be called
+    later on, for commands that take a while.
+
+    """
+
+    def __init__(self, path, handler):
+        """Initializes a new instance of the ControlServer class.
+
+        Args:
+            path (str):
+                The path of the unix socket.
+            handler (callable):
+                Called with every command and a function that sends the reply.
+        """
+
+        self.path = path
+        self.handler = handler
+        self.sock = None
+        self._selector = None
+        self._channels = set()
+
+    def open(self, selector):
+        """Starts listening and registers the socket and its connections in a selector.
+
+        Args:
+            selector (selectors.BaseSelector):
+                The selector of the loop that serves the commands. The data of every
+                registered key is a function to call when the file object is readable.
+
+        Returns:
+            True when listening, false when another instance of the service owns
+            the socket or the socket could not be created.
+        """
+
+        # Do not take the socket away from an instance that is running
+        if os.path.exists(self.path):
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                    probe.connect(self.path)
+                logger.warning('Control socket `%s` is in use, not listening for commands', self.path)
+                return False
+            except OSError:
+                pass
+
+        # For example on a read-only file system, the service runs without it
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            sock.bind(self.path)
+            os.chmod(self.path, 0o600)
+        except OSError as error:
+            sock.close()
+            logger.warning('Unable to create control socket `%s`, not listening for commands: %s',
+                           self.path, error)
+            return False
+
+        self.sock = sock
+        self.sock.listen(8)
+        self.sock.setblocking(False)
+
+        self._selector = selector
+        self._selector.register(self.sock, selectors.EVENT_READ, self._accept)
+        return True
+
+    def serve_in_background(self):
+        """Starts listening and serves commands on a background thread.
+
+        Returns:
+            True when listening, false when another instance of the service owns
+            the socket or the socket could not be created.
+        """
+
+        selector = selectors.DefaultSelector()
+        if not self.open(selector):
+            selector.close()
+            return False
+
+        def serve():
+            while self.sock:
+                for key, events in selector.select(1.0):
+                    key.data()
+
+        threading.Thread(target=serve, name='pyservice-control', daemon=True).start()
+        return True
+
+    def detach(self):
+        """Closes the sockets without removing the socket file, for use in forked children."""
+
+        for channel in self._channels:
+            channel.sock.close()
+
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    def close(self):
+        """Stops listening and removes the socket."""
+
+        if not self.sock:
+            return
+
+        self._selector.unregister(self.sock)
+        self.sock.close()
+        self.sock = None
+
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def _accept(self):
+        """Accepts a connection from a client."""
+
+        try:
+            connection, address = self.sock.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+
+        channel = JsonChannel(connection, self._handle, self._forget)
+        self._selector.register(channel, selectors.EVENT_READ, channel.handle_readable)
+        self._channels.add(channel)
+
+    def _forget(self, channel):
+        """Stops watching a connection that was closed."""
+
+        self._selector.unregister(channel)
+        self._channels.discard(channel)
+
+    def _handle(self, channel, message):
+        """Passes a command on to the handler."""
+
+        try:
+            self.handler(message, channel.send)
+        except Exception as error:
+            logger.exception('Control command `%s` failed', message.get('command'))
+            channel.send({'ok': False, 'error': str(error)})
+
+def serve_channel(sock, handler):
+    """Answers requests on a socket from a background thread, one at a time.
+
+    Used by workers, which do not own a loop that the supervisor can hook into.
+
+    Args:
+        sock (socket.socket):
+            The worker's end of the control channel.
+        handler (callable):
+            Called with every request, returns the reply.
+    """
+
+    def serve():
+        with sock, sock.makefile('rwb') as file:
+            for line in file:
+                try:
+                    reply = handler(json.loads(line))
+                except Exception as error:
+                    logger.exception('Control request failed')
+                    reply = {'ok': False, 'error': str(error)}
+
+                file.write(json.dumps(reply).encode() + b'\n')
+                file.flush()
+
+    threading.Thread(target=serve, name='pyservice-control', daemon=True).start()
+
+def send_command(path, command, timeout=60.0):
+    """Sends a command to a running service and waits for the reply.
+
+    Args:
+        path (str):
+            The path of the control socket of the service.
+        command (dict):
+            The command, with at least a `command` key.
+        timeout (float):
+            The maximum amount of seconds to wait for the reply.
+
+    Returns:
+        The reply, a dictionary with at least an `ok` key.
+    """
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall(json.dumps(command).encode() + b'\n')
+
+        with sock.makefile('rb') as file:
+            line = file.readline()
+
+    if not line:
+        return {'ok': False, 'error': 'Service closed the connection'}
+
+    return json.loads(line)
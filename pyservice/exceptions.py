@@ -69,4 +69,20 @@ class AlreadyInstalledError(Exception):
         self.message = message
 
     def __str__(self):
-        return self.message
\ No newline at end of file
+        return self.message
+
+class OverloadedError(Exception):
+    """Thrown when a request was rejected because the service is overloaded."""
+
+    def __init__(self, message):
+        """Initializes a new instance of the OverloadedError class.
+
+        Args:
+            message (str):
+                A message describing the cause of the error.
+        """
+
+        self.message = message
+
+    def __str__(self):
+        return self.message
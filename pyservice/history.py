@@ -0,0 +1,126 @@
+######################################################################################
+#
+#   This file is part of PyService.
+#
+#   PyService is free software: you can redistribute it and/or modify it under the
+#   terms of the GNU General Public License as published by the Free Software
+#   Foundation, version 2.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#   FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#   details.
+#
+#   You should have received a copy of the GNU General Public License along with
+#   this program; if not, write to the Free Software Foundation, Inc., 51
+#   Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#   Copyright: Swen Kooij (Photonios) <photonios@outlook.com>
+#
+#####################################################################################
+
+import array
+
+# Values of a sample in the history of a worker, the values after the time
+# are the ones `procstat.read_usage` reads
+TIME = 0
+CPU = 1
+RSS = 2
+CONTEXT_SWITCHES = 3
+FDS = 4
+READ_BYTES = 5
+WRITE_BYTES = 6
+SAMPLE_SIZE = 7
+
+class ResourceHistory(object):
+    """The most recent resource usage samples of every worker slot, in ring buffers.
+
+    All samples are stored in a single array of doubles that is allocated up
+    front, so the memory used is fixed: `slots * length` samples, no matter how
+    long the service runs or how many workers came and went. Counters (CPU time,
+    context switches and I/O) are stored as read, and turned into rates when the
+    history is read.
+
+    """
+
+    def __init__(self, slots, length):
+        """Initializes a new instance of the ResourceHistory class.
+
+        Args:
+            slots (int):
+                The amount of worker slots to keep a history for.
+            length (int):
+                The amount of samples to keep per slot.
+        """
+
+        self.slots = slots
+        self.length = length
+        self._samples = array.array('d', bytes(8 * slots * length * SAMPLE_SIZE))
+        self._counts = array.array('q', bytes(8 * slots))
+
+    def clear(self, index):
+        """Forgets the history of the slot at the specified index, for a new worker."""
+
+        self._counts[index] = 0
+
+    def record(self, index, sample):
+        """Adds a sample to the history of a slot, replacing the oldest one when it is full.
+
+        Args:
+            index (int):
+                The index of the slot.
+            sample (tuple):
+                The values of the sample, see the constants in this module.
+        """
+
+        offset = (index * self.length + self._counts[index] % self.length) * SAMPLE_SIZE
+        self._samples[offset:offset + SAMPLE_SIZE] = array.array('d', sample)
+        self._counts[index] += 1
+
+    def latest(self, index):
+        """Gets the most recent sample of a slot, or None when it has no samples."""
+
+        if not self._counts[index]:
+            return None
+
+        return self._sample(index, self._counts[index] - 1)
+
+    def samples(self, index):
+        """Gets the samples of a slot, from oldest to most recent."""
+
+        count = self._counts[index]
+        return [self._sample(index, number) for number in range(max(count - self.length, 0), count)]
+
+    def rates(self, index):
+        """Gets the resource usage of a slot between each pair of consecutive samples.
+
+        Returns:
+            A list of tuples, from oldest to most recent, of the CPU usage (fraction
+            of a CPU), the RSS in bytes, context switches per second, the amount of
+            open file descriptors and bytes read and written per second.
+        """
+
+        samples = self.samples(index)
+        rates = []
+
+        for previous, sample in zip(samples, samples[1:]):
+            elapsed = sample[TIME] - previous[TIME]
+            if elapsed <= 0:
+                continue
+
+            rates.append((
+                (sample[CPU] - previous[CPU]) / elapsed,
+                sample[RSS],
+                (sample[CONTEXT_SWITCHES] - previous[CONTEXT_SWITCHES]) / elapsed,
+                sample[FDS],
+                (sample[READ_BYTES] - previous[READ_BYTES]) / elapsed,
+                (sample[WRITE_BYTES] - previous[WRITE_BYTES]) / elapsed
+            ))
+
+        return rates
+
+    def _sample(self, index, number):
+        """Gets the sample with the specified sequence number of a slot."""
+
+        offset = (index * self.length + number % self.length) * SAMPLE_SIZE
+        return tuple(self._samples[offset:offset + SAMPLE_SIZE])
@@ -49,19 +49,21 @@ class PyServiceLinux(PyServicePlatformBase):
 
         super().__init__(*args, **kwargs)
 
-        # We store a start script in /etc/init.d, for now we don't support
-        # system who don't have it
-        if not os.path.exists('/etc/init.d'):
-            raise pyservice.UnsupportedPlatformError('`/etc/init.d` does not exists, this is probably not a Debian based distribution.')
-
-        # Make sure the path that PID files are stored in exists
+        # Make sure the path that PID files are stored in exists, it cannot be
+        # created in minimal or read-only containers, in which the service runs
+        # in the foreground (without PID file) and without a control socket
         pid_files_directory = os.path.join(os.path.expanduser('~'), '.pyservice_pids')
-        if not os.path.exists(pid_files_directory):
-            os.mkdir(pid_files_directory)
+        try:
+            os.makedirs(pid_files_directory, exist_ok=True)
+            writable = True
+        except OSError:
+            writable = False
 
         # Build up some paths
         self.pid_file = os.path.join(pid_files_directory, self.name + '.pid')
+        self.control_socket = os.path.join(pid_files_directory, self.name + '.sock') if writable else None
         self.control_script = '/etc/init.d/%s' % self.name
+        self.bundle = '/usr/local/lib/pyservice/%s.pyz' % self.name
 
     def start(self):
         """Starts the service (if it's installed and not running).
@@ -93,9 +95,9 @@ class PyServiceLinux(PyServicePlatformBase):
             print('* Unable to fork parent process (2): %s' % format(error))
             return False
 
-        # Register cleanup function
+        # Register cleanup function, stopping the service itself is handled by
+        # the SIGTERM handler and the shutdown hooks of the service
         atexit.register(self._clean)
-        atexit.register(self.service.stopped)
 
         # Write the PID file
         pid = str(os.getpid())
@@ -144,30 +146,32 @@ class PyServiceLinux(PyServicePlatformBase):
         # and will restart the service if auto-start is enabled
         os.remove(self.pid_file)
 
-        # Attempt to kill the process, continue to attempt to kill it until
-        # the process has died with a maximum of 5 attempts
-        attempts = 0
+        # Ask the process to stop once, and give it time to run its shutdown hooks,
+        # sending SIGTERM again would only interrupt them
         try:
-
-            while attempts < 5:
-                os.kill(pid, signal.SIGTERM)
-                time.sleep(0.2)
-                attempts += 1
-
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            return True
         except OSError as error:
-            error_message = str(error.args)
+            print("* Unable to kill the process %s" % str(error.args))
+            return False
 
-            # Check the error message, if it contains the text below,
-            # the process is no longer running and we have thus killed the process
-            if error_message.find("No such process") > 0:
+        deadline = time.monotonic() + self.service.stop_timeout
+        while time.monotonic() < deadline:
+            time.sleep(0.1)
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
                 return True
-            else:
-                print("* Unable to kill the process %s" % error_message)
-                return False
 
-        # We were unable to kill the process due to an unknown reason
-        print("* Unable to kill the process due to an unknown reason")
-        return False
+        # The process did not stop in time, stop asking
+        print("* Process did not stop within %d seconds, killing it" % self.service.stop_timeout)
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+        return True
 
     def install(self):
         """Installs the service so it can be started and stopped (if it's not installed yet).
@@ -181,6 +185,11 @@ class PyServiceLinux(PyServicePlatformBase):
         if os.getuid() != 0:
             raise pyservice.NoElevatedRightsError('We need power (aka root/sudo)')
 
+        # We store a start script in /etc/init.d, for now we don't support
+        # system who don't have it
+        if not os.path.exists('/etc/init.d'):
+            raise pyservice.UnsupportedPlatformError('`/etc/init.d` does not exists, this is probably not a Debian based distribution.')
+
         # Simple bash script to write to /etc/init.d
         start_script = """#!/bin/bash
 
@@ -201,14 +210,38 @@ class PyServiceLinux(PyServicePlatformBase):
                                 $PYTHON_PATH $SERVICE_PATH --start
                                 ;;
 
+                            rolling-restart)
+                                $PYTHON_PATH $SERVICE_PATH --rolling-restart
+                                ;;
+
+                            reload)
+                                $PYTHON_PATH $SERVICE_PATH --reconfigure
+                                ;;
+
                             *)
-                                echo 'Unknown action, try; start/stop/restart\\n'
+                                echo 'Unknown action, try; start/stop/restart/rolling-restart/reload\\n'
                         esac"""
 
         # Determine the path of the current script and the path to the python interpreter
         service_path = os.path.join(os.getcwd(), sys.argv[0])
         python_path = sys.executable
 
+        # Precompile the service and its imports into a bundle and start that instead,
+        # unless we are running from a bundle already. Imported here, so that
+        # starting and stopping do not pay for importing them.
+        import zipfile
+        from .bundle import build_bundle
+
+        if self.service.bundle_on_install and not zipfile.is_zipfile(service_path):
+            try:
+                modules = build_bundle(service_path, self.bundle)
+            except Exception as error:
+                print('* Unable to build bundle `%s`: %s' % (self.bundle, str(error)))
+                return False
+
+            print('* Bundled %d modules into `%s`' % (len(modules), self.bundle))
+            service_path = self.bundle
+
         # Replace the python path and the path to our service in the start script
         start_script = start_script.replace('%PYTHON_PATH%', python_path)
         start_script = start_script.replace('%SERVICE_PATH%', service_path)
@@ -242,6 +275,10 @@ class PyServiceLinux(PyServicePlatformBase):
             print("* Unable to uninstall, failed to remove control script: %s" % str(error))
             return False
 
+        # Remove the bundle, if one was built during installation
+        if os.path.exists(self.bundle):
+            os.remove(self.bundle)
+
         return True
 
     def is_installed(self):
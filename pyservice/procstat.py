@@ -0,0 +1,107 @@
+######################################################################################
+#
+#   This file is part of PyService.
+#
+#   PyService is free software: you can redistribute it and/or modify it under the
+#   terms of the GNU General Public License as published by the Free Software
+#   Foundation, version 2.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#   FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#   details.
+#
+#   You should have received a copy of the GNU General Public License along with
+#   this program; if not, write to the Free Software Foundation, Inc., 51
+#   Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#   Copyright: Swen Kooij (Photonios) <photonios@outlook.com>
+#
+#####################################################################################
+
+import os
+
+def read_usage(pid):
+    """Reads the resources a process uses and has used.
+
+    Args:
+        pid (int):
+            The PID of the process to read the resource usage of.
+
+    Returns:
+        A tuple of the CPU time in seconds, the resident set size in bytes, the
+        amount of context switches, the amount of open file descriptors and the
+        amount of bytes read and written (including sockets and pipes), or None
+        when the process does not exist (anymore). Values that are not readable
+        (for example the I/O of processes of other users) are zero.
+    """
+
+    try:
+        with open('/proc/%d/stat' % pid, 'r') as file:
+            stat = file.read()
+        with open('/proc/%d/status' % pid, 'r') as file:
+            status = file.readlines()
+    except (IOError, OSError):
+        return None
+
+    # The process name can contain spaces, so only split what comes after it,
+    # utime and stime are the 14th and 15th field and rss (in pages) the 24th
+    fields = stat[stat.rfind(')') + 2:].split()
+
+    # Clock ticks and page size are looked up here instead of at import time,
+    # this module is imported on Windows too, which has no sysconf
+    cpu_time = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    rss = int(fields[21]) * os.sysconf('SC_PAGE_SIZE')
+
+    context_switches = 0
+    for line in status:
+        if line.startswith(('voluntary_ctxt_switches:', 'nonvoluntary_ctxt_switches:')):
+            context_switches += int(line.split()[1])
+
+    try:
+        fds = len(os.listdir('/proc/%d/fd' % pid))
+    except (IOError, OSError):
+        fds = 0
+
+    io = {}
+    try:
+        with open('/proc/%d/io' % pid, 'r') as file:
+            for line in file:
+                key, value = line.split(':')
+                io[key] = int(value)
+    except (IOError, OSError):
+        pass
+
+    return cpu_time, rss, context_switches, fds, io.get('rchar', 0), io.get('wchar', 0)
+
+def read_listen_backlog(sock):
+    """Reads the number of connections waiting to be accepted on a listening socket.
+
+    For sockets in the LISTEN state, the kernel reports the length of the accept
+    queue as the receive queue in /proc/net/tcp and /proc/net/tcp6.
+
+    Args:
+        sock (socket.socket):
+            The listening TCP socket to read the backlog of.
+
+    Returns:
+        The number of connections in the accept queue, or zero when the socket
+        could not be found.
+    """
+
+    inode = str(os.fstat(sock.fileno()).st_ino)
+
+    for table in ('/proc/net/tcp', '/proc/net/tcp6'):
+        try:
+            with open(table, 'r') as file:
+                lines = file.readlines()[1:]
+        except (IOError, OSError):
+            continue
+
+        # Columns: sl local_address rem_address st tx_queue:rx_queue ... inode
+        for line in lines:
+            fields = line.split()
+            if len(fields) > 9 and fields[9] == inode:
+                return int(fields[4].split(':')[1], 16)
+
+    return 0
@@ -19,12 +19,26 @@
 #
 #####################################################################################
 
+import os
 import sys
+import json
+import time
+import signal
+import logging
+import threading
+import socket
 import platform
 import pyservice
 
 from .linux import PyServiceLinux
 from .windows import PyServiceWindows
+from .autoscaler import Autoscaler
+from .admission import AdmissionController, GradientLimit
+from .state import StateStore
+from .subprocesses import SubprocessPool
+from .shutdown import ShutdownRegistry
+from .control import ControlServer, send_command
+from .supervisor import PyServiceSupervisor, run_executed_worker, WORKER_ENVIRONMENT, QUEUE_LENGTH, IN_FLIGHT, RECEIVED, READY, REQUESTS
 
 class PyService(object):
     """Interface for classes who wish to represent a service.
@@ -36,8 +50,100 @@ class PyService(object):
     By passing the program's command line arguments, PyService can take care
     of handling parameters such as `--start` and `--install`.
 
+    By overriding the class attributes below, the deriving class can run the
+    service in multiple worker processes, which are scaled between `min_workers`
+    and `max_workers` by a supervisor, based on the load of the workers.
+
+    To protect the service against overload, handlers can be wrapped with
+    `self.admission.wrap`, which limits the amount of requests that are handled
+    concurrently and rejects requests quickly once too many are waiting.
+
+    State that is expensive to rebuild, such as caches, can be saved with
+    `self.state.save` when the service stops and mapped back in with
+    `self.state.load` when the next generation of the service starts.
+
+    Child processes should be started through `self.subprocesses`, which never
+    blocks the service, reaps the children and stops them when the service stops.
+
+    Work that has to be done when the service stops, such as flushing buffers,
+    should be registered with `self.shutdown.register`. On SIGTERM, `stopped` is
+    called to end the blocking loop, after which these hooks run concurrently.
+
+    The configuration of the service (`self.config`) is loaded from `config_file`
+    and can be changed while the service runs with `--reconfigure` or SIGHUP, which
+    calls `reconfigured` in every worker.
+
     """
 
+    # Amount of worker processes, when `max_workers` is larger than one, the
+    # service runs under a supervisor that scales between these bounds
+    min_workers = 1
+    max_workers = 1
+
+    # Addresses (host, port) the supervisor listens on, the listening sockets
+    # are shared by all workers and available as `self.sockets`
+    listen = []
+    listen_backlog = 128
+
+    # When true, the supervisor accepts the connections and passes each of them
+    # to the least loaded worker, see `receive_connection`
+    dispatch = False
+
+    # Seconds between two samples of the load of the workers
+    sample_interval = 1.0
+
+    # Seconds a worker gets to exit after being asked to stop, before it is killed
+    drain_timeout = 30.0
+
+    # Workers that exit unexpectedly are replaced after `respawn_delay` seconds,
+    # which doubles with every other unexpected exit within `crash_window` seconds
+    # (up to `max_respawn_delay`). After `max_crashes` unexpected exits within
+    # `crash_window` seconds, the supervisor stops with a non-zero exit status.
+    respawn_delay = 0.5
+    max_respawn_delay = 30.0
+    max_crashes = 5
+    crash_window = 60.0
+
+    # Seconds `--stop` waits for the service to exit, before it is killed
+    stop_timeout = 60.0
+
+    # When false, a worker only counts as ready once it called `self.ready()`
+    ready_on_start = True
+
+    # Maximum amount of child processes in `self.subprocesses` running at once
+    max_subprocesses = 8
+
+    # Seconds without activity after which all workers are stopped, the listening
+    # sockets stay open and the next connection starts the workers again. Workers
+    # using less than `idle_cpu` (fraction of a CPU) count as inactive. Requires
+    # `listen`, like `min_workers = 0`, as connections wake the workers up.
+    idle_timeout = None
+    idle_cpu = 0.01
+
+    # When true, `--install` compiles the service and the modules it imports into
+    # a bundle of bytecode, which is what the installed service starts. Such a
+    # service does not support `--rolling-restart`, the bundle is fixed.
+    bundle_on_install = False
+
+    # Version of the layout of the snapshots in `self.state`, snapshots saved with
+    # another version are discarded when `discard_state_on_mismatch` is true
+    state_schema_version = 0
+    discard_state_on_mismatch = True
+
+    # JSON file the configuration is loaded from, see `load_config`
+    config_file = None
+
+    # A rolling restart replaces `rolling_batch_size` workers at a time, keeps at
+    # least `rolling_min_capacity` (fraction) of the workers ready, and fails when
+    # a new worker is not ready and healthy within `rolling_health_timeout` seconds
+    rolling_batch_size = 1
+    rolling_min_capacity = 0.5
+    rolling_health_timeout = 30.0
+
+    # Amount of resource usage samples (taken every `sample_interval` seconds) the
+    # supervisor keeps per worker, for `--top`
+    history_length = 60
+
     def __init__(self, name, description, auto_start):
         """Initializes a new instance of the PyService class.
 
@@ -49,6 +155,10 @@ class PyService(object):
         * --start
         * --stop
         * --run
+        * --foreground
+        * --reconfigure [config file]
+        * --rolling-restart
+        * --top
 
         Based on the specified command line parameters, the associated action
         will be taken.
@@ -56,6 +166,19 @@ class PyService(object):
         If none of the command line parameters above is specified, it will default
         to `--run` which will run the program without being installed as a service.
 
+        `--foreground` runs the service under a supervisor without daemonizing,
+        which is meant for containers, where the service can be PID 1.
+
+        `--reconfigure` pushes the configuration (from the specified file or from
+        `config_file`) to the running service, without restarting it.
+
+        `--rolling-restart` replaces the workers of the running service a batch at a
+        time by workers running the code on disk, see `PyServiceSupervisor`. Not
+        supported by services that run from a bundle (`bundle_on_install`).
+
+        `--top` shows the resource usage of the workers of the running service,
+        refreshed every `sample_interval` seconds until interrupted.
+
         Args:
             name (str):
                 The name of the service, this name is used when installing or looking
@@ -74,7 +197,14 @@ class PyService(object):
             '--uninstall': self._uninstall,
             '--start': self._start,
             '--stop': self._stop,
-            '--run': self.started
+            '--run': self._run,
+            '--foreground': self._foreground,
+            '--reconfigure': self._reconfigure,
+            '--rolling-restart': self._rolling_restart,
+            '--top': self._top,
+
+            # Used by the supervisor to start workers during a rolling restart
+            '--worker': self._worker
         }
 
         # Maps systems/platforms to the right classes
@@ -88,6 +218,30 @@ class PyService(object):
         self.description = description
         self.auto_start = auto_start
 
+        # Loaded when the service starts, replaced when it is reconfigured
+        self.config = {}
+        self.control_socket = None
+        self._config_lock = threading.RLock()
+
+        # Set by the supervisor when running in multiple worker processes
+        self.sockets = []
+        self.worker_slot = None
+        self.dispatch_channel = None
+
+        # Limits the amount of concurrently handled requests
+        self.admission = self.create_admission_controller()
+
+        # Snapshots of state that survive restarts
+        self.state = self.create_state_store()
+
+        # Child processes, stopped when the service stops
+        self.subprocesses = SubprocessPool(self.max_subprocesses)
+
+        # Functions to call when the service stops
+        self.shutdown = ShutdownRegistry()
+        self.shutdown.register('subprocesses', self.subprocesses.close,
+                               deadline=self.subprocesses.kill_timeout + 1)
+
         # Determine whether this platform is supported
         if platform.system() not in self.platform_map:
             print('* Unsupported platform: `%s`' % platform.system())
@@ -98,7 +252,9 @@ class PyService(object):
             self.platform_impl = self.platform_map[platform.system()](self, self.name, self.description, self.auto_start)
         except Exception as error:
             print('* Error: %s' % str(error))
-            return
+            sys.exit(1)
+
+        self.control_socket = getattr(self.platform_impl, 'control_socket', None)
 
         # Are there any command line parameters?
         cmd_option = '--run'
@@ -155,6 +311,181 @@ class PyService(object):
 
         raise NotImplementedError('`uninstalled` not implemented in derived class')
 
+    def load_config(self):
+        """Virtual, can be overridden by the derived class.
+
+        Called when the service starts and when it is asked to reload its
+        configuration (SIGHUP). By default, reads `config_file` as JSON.
+
+        Returns:
+            The configuration, a dictionary that can be serialized to JSON.
+        """
+
+        if not self.config_file:
+            return {}
+
+        with open(self.config_file, 'r') as file:
+            return json.load(file)
+
+    def validate_config(self, config):
+        """Virtual, can be overridden by the derived class.
+
+        Called before a new configuration is applied, raise an exception (such as
+        ValueError) to refuse it.
+
+        Args:
+            config (dict):
+                The new configuration.
+        """
+
+        if not isinstance(config, dict):
+            raise ValueError('Configuration must be a JSON object')
+
+    def reconfigured(self, old, new):
+        """Virtual, can be overridden by the derived class.
+
+        Called in every worker (from a background thread) when the configuration
+        changed while the service is running. Raise an exception or return False to
+        reject the new configuration, which rolls back all workers to the old one.
+
+        Args:
+            old (dict):
+                The configuration that was in use.
+            new (dict):
+                The configuration to use from now on.
+        """
+
+        pass
+
+    def health_check(self):
+        """Virtual, can be overridden by the derived class.
+
+        Called (from a background thread) in every new worker of a rolling restart
+        once it is ready. Raise an exception or return False when the worker is not
+        able to serve requests, which aborts the rolling restart.
+        """
+
+        return True
+
+    def create_autoscaler(self):
+        """Virtual, can be overridden by the derived class.
+
+        Called by the supervisor to create the autoscaler that decides how many
+        workers should be running. Override this to tune the scaling thresholds
+        and cooldowns.
+
+        Returns:
+            An instance of the Autoscaler class.
+        """
+
+        return Autoscaler(self.min_workers, self.max_workers)
+
+    def create_admission_controller(self):
+        """Virtual, can be overridden by the derived class.
+
+        Called when the service is created, to create the admission controller
+        that is available as `self.admission`. By default, the concurrency limit
+        adapts to the observed latency. Override this to use a fixed or AIMD limit,
+        or to change the size of the wait queue.
+
+        Returns:
+            An instance of the AdmissionController class.
+        """
+
+        return AdmissionController(GradientLimit())
+
+    def create_state_store(self):
+        """Virtual, can be overridden by the derived class.
+
+        Called when the service is created, to create the state store that is
+        available as `self.state`. By default, snapshots are stored in
+        `~/.pyservice_state/<name>`.
+
+        Returns:
+            An instance of the StateStore class.
+        """
+
+        directory = os.path.join(os.path.expanduser('~'), '.pyservice_state', self.name)
+        return StateStore(directory, self.state_schema_version, self.discard_state_on_mismatch)
+
+    def report_queue_length(self, queue_length):
+        """Reports the amount of work that is queued up in this worker.
+
+        The supervisor takes the reported queue length into account when deciding
+        whether to scale up or down. Has no effect when not running in a worker.
+
+        Args:
+            queue_length (int):
+                The amount of requests or jobs waiting to be processed.
+        """
+
+        if self.worker_slot:
+            self.worker_slot.set(QUEUE_LENGTH, queue_length)
+
+    def ready(self):
+        """Reports that this worker is ready to handle requests.
+
+        Only needed when `ready_on_start` is false, for services that need to do
+        some work (such as warming up caches) before they can handle requests.
+        Has no effect when not running in a worker.
+        """
+
+        if self.worker_slot:
+            self.worker_slot.set(READY, 1)
+
+    def request_started(self):
+        """Reports that this worker started handling a request.
+
+        In dispatch mode, the supervisor passes new connections to the worker with
+        the least requests in flight, and requests keep an idle service from being
+        stopped (see `idle_timeout`). Has no effect when not running in a worker.
+        """
+
+        if self.worker_slot:
+            self.worker_slot.add(IN_FLIGHT, 1)
+            self.worker_slot.add(REQUESTS, 1)
+
+    def request_finished(self):
+        """Reports that this worker finished handling a request.
+
+        Has no effect when not running in a worker.
+        """
+
+        if self.worker_slot:
+            self.worker_slot.add(IN_FLIGHT, -1)
+
+    def receive_connection(self):
+        """Receives a connection the supervisor dispatched to this worker.
+
+        Only used in dispatch mode, in which `dispatch_channel` becomes readable
+        whenever a connection is waiting for this worker. Never blocks, but the
+        returned socket itself is in blocking mode.
+
+        Returns:
+            A tuple of the connected socket and the address of the peer, or None
+            when no connection is waiting.
+        """
+
+        if not self.dispatch_channel:
+            return None
+
+        try:
+            message, fds, flags, address = socket.recv_fds(self.dispatch_channel, 1, 1)
+        except (BlockingIOError, InterruptedError):
+            return None
+
+        # An empty message means the supervisor closed the channel
+        if not fds:
+            return None
+
+        self.worker_slot.add(RECEIVED, 1)
+        connection = socket.socket(fileno=fds[0])
+
+        try:
+            return connection, connection.getpeername()
+        except OSError:
+            return connection, None
+
     def is_installed(self):
         """Determines whether this service is installed on this system.
 
@@ -196,9 +527,264 @@ class PyService(object):
             return False
 
         # Call event handler
-        self.started()
+        self._run()
         return result
 
+    def _run(self):
+        """Runs this service in the current process.
+
+        When the service is configured to run in multiple workers, or to stop its
+        workers when idle, a supervisor takes over the current process and calls
+        the event handler in each worker.
+
+        Returns:
+            The result of the event handler or the supervisor.
+        """
+
+        self.config = self.load_config()
+        self._apply_builtin_config(self.config)
+
+        if self.max_workers > 1 or self.min_workers < 1 or self.idle_timeout:
+            return PyServiceSupervisor(self).run()
+
+        signal.signal(signal.SIGTERM, self._terminate)
+
+        # SIGHUP only wakes up a background thread, which reloads the
+        # configuration outside of the signal handler (Windows has no SIGHUP)
+        if hasattr(signal, 'SIGHUP'):
+            reload = threading.Event()
+            threading.Thread(target=self._reload, args=(reload,), name='pyservice-reload', daemon=True).start()
+            signal.signal(signal.SIGHUP, lambda signum, frame: reload.set())
+
+        # Without a supervisor, commands are served from a background thread
+        control = None
+        if self.control_socket:
+            control = ControlServer(self.control_socket, lambda command, reply: reply(self._control(command)))
+            control.serve_in_background()
+
+        try:
+            return self.started()
+        finally:
+            if control:
+                control.close()
+            self._shutdown()
+
+    def _reload(self, requested):
+        """Reloads the configuration whenever SIGHUP was received, when running without a supervisor.
+
+        Runs on a background thread, like the commands on the control socket.
+
+        Args:
+            requested (threading.Event):
+                Set by the signal handler for SIGHUP.
+        """
+
+        while True:
+            requested.wait()
+            requested.clear()
+
+            try:
+                result = self._control({'command': 'reconfigure', 'config': self.load_config()})
+            except Exception as error:
+                result = {'ok': False, 'error': str(error)}
+
+            if not result['ok']:
+                logging.getLogger(__name__).error('Unable to reload the configuration: %s', result['error'])
+
+    def _control(self, command):
+        """Handles a request from the supervisor or the control socket in this process.
+
+        Args:
+            command (dict):
+                The request.
+
+        Returns:
+            The reply.
+        """
+
+        name = command.get('command')
+
+        if name == 'health':
+            try:
+                if self.health_check() is False:
+                    raise ValueError('Health check failed')
+            except Exception as error:
+                return {'ok': False, 'error': str(error)}
+
+            return {'ok': True}
+
+        if name != 'reconfigure':
+            return {'ok': False, 'error': 'Unknown command `%s`' % name}
+
+        new = command.get('config')
+        with self._config_lock:
+            old = self.config
+
+            try:
+                self.validate_config(new)
+                self._apply_builtin_config(new)
+                if self.reconfigured(old, new) is False:
+                    raise ValueError('Rejected by the service')
+            except Exception as error:
+                self._apply_builtin_config(old)
+                return {'ok': False, 'error': str(error)}
+
+            self.config = new
+            return {'ok': True}
+
+    def _apply_builtin_config(self, config):
+        """Applies the settings PyService itself understands from a configuration.
+
+        Args:
+            config (dict):
+                The configuration, `log_level` sets the level of the root logger.
+        """
+
+        if 'log_level' in config:
+            logging.getLogger().setLevel(config['log_level'])
+
+    def _terminate(self, signum, frame):
+        """Signal handler for SIGTERM, calls the event handler to end the blocking loop.
+
+        Only the first SIGTERM does so, the event handler would otherwise
+        interrupt the shutdown hooks.
+        """
+
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        self.stopped()
+
+    def _shutdown(self):
+        """Runs the shutdown hooks, after the blocking loop ended."""
+
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+        results = self.shutdown.run()
+        failed = [name for name, result in results.items() if result != 'ok']
+        if failed:
+            print('* Shutdown hooks did not complete: %s' % ', '.join(sorted(failed)))
+
+    def _foreground(self):
+        """Runs this service in the foreground, under a supervisor.
+
+        Does not fork into the background, does not detach from the terminal and
+        does not write a PID file. The supervisor reaps all children, forwards
+        signals to the workers and exits with a non-zero status when the workers
+        did not stop cleanly or kept exiting unexpectedly (see `max_crashes`),
+        which makes it suitable to run as PID 1 in a container.
+
+        Returns:
+            Never returns, exits with the exit status of the supervisor.
+        """
+
+        self.config = self.load_config()
+        self._apply_builtin_config(self.config)
+
+        supervisor = PyServiceSupervisor(self)
+        supervisor.run()
+        sys.exit(supervisor.exit_status)
+
+    def _reconfigure(self):
+        """Pushes a new configuration to the running service.
+
+        The configuration is read from the file specified after `--reconfigure`, or
+        from `config_file`.
+
+        Returns:
+            True when all workers of the service accepted the configuration, false
+            when it was rejected (and rolled back).
+        """
+
+        path = sys.argv[2] if len(sys.argv) > 2 else self.config_file
+        if not path:
+            print('* No configuration file specified')
+            return False
+
+        with open(path, 'r') as file:
+            config = json.load(file)
+
+        self.validate_config(config)
+
+        print('* Reconfiguring %s' % self.name)
+        try:
+            result = send_command(self.control_socket, {'command': 'reconfigure', 'config': config})
+        except (OSError, TypeError):
+            print('* Not running')
+            return False
+
+        if not result['ok']:
+            print('* Reconfiguration failed: %s' % result['error'])
+            return False
+
+        return True
+
+    def _rolling_restart(self):
+        """Replaces the workers of the running service, a batch at a time.
+
+        Returns:
+            True when all workers were replaced, false when the rolling restart
+            failed (and was rolled back).
+        """
+
+        print('* Restarting %s' % self.name)
+        try:
+            result = send_command(self.control_socket, {'command': 'rolling-restart'}, timeout=None)
+        except (OSError, TypeError):
+            print('* Not running')
+            return False
+
+        if not result['ok']:
+            print('* Rolling restart failed: %s' % result['error'])
+            return False
+
+        print('* Replaced %d workers' % result['replaced'])
+        return True
+
+    def _top(self):
+        """Shows the resource usage of the workers of the running service, until interrupted.
+
+        Returns:
+            True when interrupted, false when the usage could not be retrieved.
+        """
+
+        # Only needed here, keep it out of the start-up of the service
+        from . import top
+
+        try:
+            while True:
+                try:
+                    result = send_command(self.control_socket, {'command': 'top'})
+                except (OSError, TypeError):
+                    print('* Not running')
+                    return False
+
+                if not result['ok']:
+                    print('* Unable to show the workers: %s' % result['error'])
+                    return False
+
+                # Clear the terminal before drawing the table
+                sys.stdout.write('\033[H\033[2J' + top.render(result))
+                sys.stdout.flush()
+                time.sleep(result['interval'])
+        except KeyboardInterrupt:
+            return True
+
+    def _worker(self):
+        """Runs a worker that a supervisor started during a rolling restart, never returns.
+
+        Returns:
+            False when this process was not started by a supervisor.
+        """
+
+        worker = os.environ.pop(WORKER_ENVIRONMENT, None)
+        if not worker:
+            print('* Workers are started by the supervisor')
+            return False
+
+        worker = json.loads(worker)
+        self.config = worker['config']
+        self._apply_builtin_config(self.config)
+        run_executed_worker(self, worker)
+
     def _stop(self):
         """Stop this service.
 
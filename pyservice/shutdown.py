@@ -0,0 +1,171 @@
+######################################################################################
+#
+#   This file is part of PyService.
+#
+#   PyService is free software: you can redistribute it and/or modify it under the
+#   terms of the GNU General Public License as published by the Free Software
+#   Foundation, version 2.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#   FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#   details.
+#
+#   You should have received a copy of the GNU General Public License along with
+#   this program; if not, write to the Free Software Foundation, Inc., 51
+#   Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#   Copyright: Swen Kooij (Photonios) <photonios@outlook.com>
+#
+#####################################################################################
+
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class ShutdownHook(object):
+    """A function to call when the service stops.
+
+    """
+
+    def __init__(self, name, function, after, deadline):
+        """Initializes a new instance of the ShutdownHook class.
+
+        Args:
+            name (str):
+                Unique name of the hook, used to refer to it in `after`.
+            function (callable):
+                The function to call, without arguments.
+            after (list):
+                Names of the hooks that have to finish before this hook starts.
+            deadline (float):
+                The maximum amount of seconds this hook may take.
+        """
+
+        self.name = name
+        self.function = function
+        self.after = list(after)
+        self.deadline = deadline
+
+        self.started_at = None
+        self.finished = False
+        self.result = None
+
+class ShutdownRegistry(object):
+    """Runs the functions that have to be called when the service stops.
+
+    Hooks that do not depend on each other run concurrently, each on its own
+    thread, so stopping takes as long as the slowest chain of dependent hooks
+    instead of all hooks together. A hook that does not finish before its deadline
+    is logged and left behind, the hooks that depend on it start anyway.
+
+    """
+
+    def __init__(self):
+        """Initializes a new instance of the ShutdownRegistry class."""
+
+        self._hooks = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._ran = False
+
+    def register(self, name, function, after=(), deadline=5.0):
+        """Registers a function to call when the service stops.
+
+        Args:
+            name (str):
+                Unique name of the hook, used to refer to it in `after`.
+            function (callable):
+                The function to call, without arguments.
+            after (list):
+                Names of the hooks that have to finish before this hook starts.
+            deadline (float):
+                The maximum amount of seconds this hook may take.
+        """
+
+        with self._lock:
+            if name in self._hooks:
+                raise ValueError('Shutdown hook `%s` is already registered' % name)
+
+            self._hooks[name] = ShutdownHook(name, function, after, deadline)
+
+    def unregister(self, name):
+        """Removes a previously registered hook."""
+
+        with self._lock:
+            self._hooks.pop(name, None)
+
+    def run(self):
+        """Runs all hooks, only the first call does anything.
+
+        Returns:
+            A dictionary that maps the name of every hook to its result: `ok`,
+            `failed` (raised an exception), `overrun` (missed its deadline) or
+            `skipped` (part of a cycle of dependencies).
+        """
+
+        with self._lock:
+            if self._ran:
+                return {}
+
+            self._ran = True
+            hooks = dict(self._hooks)
+
+            # Dependencies on hooks that are not registered are ignored
+            waiting = dict((name, set(hook.after) & set(hooks)) for name, hook in hooks.items())
+            running = []
+
+            while waiting or running:
+                now = time.monotonic()
+
+                # Start every hook that no longer waits for another hook
+                for name in [name for name, after in waiting.items() if not after]:
+                    del waiting[name]
+                    hook = hooks[name]
+                    hook.started_at = now
+                    running.append(hook)
+                    threading.Thread(target=self._call, args=(hook,),
+                                     name='pyservice-shutdown-%s' % name, daemon=True).start()
+
+                # A cycle leaves hooks waiting with nothing running
+                if not running:
+                    logger.error('Shutdown hooks %s depend on each other, skipping them',
+                                 ', '.join(sorted(waiting)))
+                    for name in waiting:
+                        hooks[name].result = 'skipped'
+                    break
+
+                for hook in list(running):
+                    if not hook.finished and now - hook.started_at >= hook.deadline:
+                        logger.warning('Shutdown hook `%s` did not finish within %.1f seconds, skipping it',
+                                       hook.name, hook.deadline)
+                        hook.result = 'overrun'
+
+                    if hook.finished or hook.result == 'overrun':
+                        running.remove(hook)
+                        for after in waiting.values():
+                            after.discard(hook.name)
+
+                if running and not any(not after for after in waiting.values()):
+                    timeout = min(hook.started_at + hook.deadline for hook in running) - now
+                    self._changed.wait(max(timeout, 0))
+
+            return dict((name, hook.result) for name, hook in hooks.items())
+
+    def _call(self, hook):
+        """Calls the function of a hook, on the thread of the hook."""
+
+        try:
+            hook.function()
+            result = 'ok'
+        except BaseException:
+            logger.exception('Shutdown hook `%s` failed', hook.name)
+            result = 'failed'
+
+        with self._lock:
+            hook.finished = True
+            if hook.result is None:
+                hook.result = result
+            self._changed.notify()
@@ -0,0 +1,222 @@
+######################################################################################
+#
+#   This file is part of PyService.
+#
+#   PyService is free software: you can redistribute it and/or modify it under the
+#   terms of the GNU General Public License as published by the Free Software
+#   Foundation, version 2.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#   FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#   details.
+#
+#   You should have received a copy of the GNU General Public License along with
+#   this program; if not, write to the Free Software Foundation, Inc., 51
+#   Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#   Copyright: Swen Kooij (Photonios) <photonios@outlook.com>
+#
+#####################################################################################
+
+import os
+import mmap
+import zlib
+import struct
+import logging
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Every snapshot starts with a header: magic, format version, schema version,
+# generation, length of the payload and the CRC32 of the payload
+HEADER = struct.Struct('<8sIIIQI')
+MAGIC = b'PYSVCST\0'
+FORMAT_VERSION = 1
+
+class StateStore(object):
+    """Stores snapshots of in-process state, so it survives restarts of the service.
+
+    A snapshot is an opaque blob of bytes, stored in a file per snapshot name.
+    Saving replaces the file atomically. Loading maps the file into memory and
+    returns a read-only memoryview on it, so the next generation of the service
+    gets its state back without copying or deserializing it (for example by
+    casting the view to an array, or by storing an mmap-friendly layout).
+
+    Every snapshot carries the schema version of the service that saved it, and a
+    checksum. Corrupt snapshots are never returned, snapshots with a different
+    schema version are discarded unless `discard_on_mismatch` is false.
+
+    Workers of the same service can save the same snapshot at the same time,
+    every save writes its own temporary file and saves of a snapshot are
+    serialized by a lock file (where the platform supports `fcntl`).
+
+    """
+
+    def __init__(self, directory, schema_version=0, discard_on_mismatch=True):
+        """Initializes a new instance of the StateStore class.
+
+        Args:
+            directory (str):
+                The directory to store the snapshots in.
+            schema_version (int):
+                The version of the layout of the snapshots, bump it whenever the
+                layout changes in an incompatible way.
+            discard_on_mismatch (bool):
+                True to discard snapshots saved with a different schema version,
+                false to return them anyway (see `loaded_schema_versions`).
+        """
+
+        self.directory = directory
+        self.schema_version = schema_version
+        self.discard_on_mismatch = discard_on_mismatch
+        self.loaded_schema_versions = {}
+        self._mappings = {}
+
+    def save(self, name, data):
+        """Saves a snapshot, replacing the previous snapshot with the same name.
+
+        Args:
+            name (str):
+                The name of the snapshot.
+            data (bytes-like):
+                The contents of the snapshot, any object supporting the buffer protocol.
+        """
+
+        # Only the user of the service may plant snapshots, daemons run without
+        # a umask (see `PyServiceLinux.start`)
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+
+        path = self._path(name)
+        data = memoryview(data).cast('B')
+
+        with open(os.open(path + '.lock', os.O_CREAT | os.O_RDWR, 0o600)) as lock:
+            # The generation is only unique while nobody else saves this snapshot
+            if fcntl:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+
+            generation = self._read_generation(path) + 1
+            header = HEADER.pack(MAGIC, FORMAT_VERSION, self.schema_version, generation,
+                                 len(data), zlib.crc32(data))
+
+            # Write to a temporary file first, so that a crash never leaves
+            # a half written snapshot behind
+            fd, temporary_path = tempfile.mkstemp(prefix=name + '.', suffix='.tmp', dir=self.directory)
+            try:
+                with open(fd, 'wb') as file:
+                    file.write(header)
+                    file.write(data)
+                    file.flush()
+                    os.fsync(file.fileno())
+
+                os.replace(temporary_path, path)
+            except BaseException:
+                os.remove(temporary_path)
+                raise
+
+    def load(self, name):
+        """Maps a snapshot into memory.
+
+        The returned view stays valid until `close` is called, which must not be
+        done while the view (or anything derived from it) is still in use.
+
+        Args:
+            name (str):
+                The name of the snapshot.
+
+        Returns:
+            A read-only memoryview on the contents of the snapshot, or None when
+            there is no (valid) snapshot with this name.
+        """
+
+        path = self._path(name)
+
+        try:
+            with open(path, 'rb') as file:
+                size = os.fstat(file.fileno()).st_size
+                if size < HEADER.size:
+                    return self._discard(path, 'truncated')
+                mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return None
+
+        magic, format_version, schema_version, generation, length, checksum = \
+            HEADER.unpack_from(mapping)
+
+        view = memoryview(mapping)[HEADER.size:HEADER.size + length]
+        reason = None
+
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            reason = 'unknown format'
+        elif len(view) != length:
+            reason = 'truncated'
+        elif zlib.crc32(view) != checksum:
+            reason = 'checksum mismatch'
+        elif schema_version != self.schema_version and self.discard_on_mismatch:
+            reason = 'schema version %d instead of %d' % (schema_version, self.schema_version)
+
+        if reason:
+            view.release()
+            mapping.close()
+            return self._discard(path, reason)
+
+        self._release(name)
+        self._mappings[name] = (mapping, view)
+        self.loaded_schema_versions[name] = schema_version
+        return view
+
+    def close(self):
+        """Unmaps all snapshots that were loaded."""
+
+        for name in list(self._mappings):
+            self._release(name)
+
+    def _path(self, name):
+        """Gets the path of the file of the snapshot with the specified name."""
+
+        return os.path.join(self.directory, name + '.snapshot')
+
+    def _read_generation(self, path):
+        """Reads the generation of an existing snapshot, zero when there is none."""
+
+        try:
+            with open(path, 'rb') as file:
+                header = file.read(HEADER.size)
+        except FileNotFoundError:
+            return 0
+
+        if len(header) < HEADER.size or header[:len(MAGIC)] != MAGIC:
+            return 0
+
+        return HEADER.unpack(header)[3]
+
+    def _discard(self, path, reason):
+        """Removes an unusable snapshot.
+
+        Returns:
+            None, so it can be returned from `load` directly.
+        """
+
+        logger.warning('Discarding snapshot `%s`: %s', path, reason)
+
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+        return None
+
+    def _release(self, name):
+        """Unmaps the snapshot with the specified name, if it was loaded."""
+
+        if name not in self._mappings:
+            return
+
+        mapping, view = self._mappings.pop(name)
+        view.release()
+        mapping.close()
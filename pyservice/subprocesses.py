@@ -0,0 +1,357 @@
+######################################################################################
+#
+#   This file is part of PyService.
+#
+#   PyService is free software: you can redistribute it and/or modify it under the
+#   terms of the GNU General Public License as published by the Free Software
+#   Foundation, version 2.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#   FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#   details.
+#
+#   You should have received a copy of the GNU General Public License along with
+#   this program; if not, write to the Free Software Foundation, Inc., 51
+#   Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#   Copyright: Swen Kooij (Photonios) <photonios@outlook.com>
+#
+#####################################################################################
+
+import os
+import time
+import signal
+import logging
+import selectors
+import threading
+import subprocess
+import collections
+
+logger = logging.getLogger(__name__)
+
+class ManagedProcess(object):
+    """A child process that was spawned through a SubprocessPool.
+
+    """
+
+    def __init__(self, args, timeout, callback, kwargs):
+        """Initializes a new instance of the ManagedProcess class.
+
+        Args:
+            args (list):
+                The program to run and its arguments.
+            timeout (float):
+                The maximum amount of seconds the process may run, or None.
+            callback (callable):
+                Called with this instance once the process exited, or None.
+            kwargs (dict):
+                Additional keyword arguments for `subprocess.Popen`.
+        """
+
+        self.args = args
+        self.timeout = timeout
+        self.callback = callback
+        self.kwargs = kwargs
+
+        self.process = None
+        self.returncode = None
+        self.timed_out = False
+        self.deadline = None
+        self.pidfd = None
+
+        self._done = threading.Event()
+
+    @property
+    def pid(self):
+        """The PID of the process, None when it has not been started yet."""
+
+        return self.process.pid if self.process else None
+
+    def done(self):
+        """Determines whether the process exited (or was cancelled before it started)."""
+
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Waits for the process to exit.
+
+        Args:
+            timeout (float):
+                The maximum amount of seconds to wait, or None to wait forever.
+
+        Returns:
+            The return code of the process, or None when it is still running.
+        """
+
+        self._done.wait(timeout)
+        return self.returncode
+
+class SubprocessPool(object):
+    """Runs child processes with bounded concurrency and reaps them in the background.
+
+    Spawning never blocks: when `max_concurrency` processes are running, the
+    process is queued and started as soon as another process exits. A single
+    background thread waits for all children at once, on their pidfds where the
+    platform supports them, and enforces the per-process timeouts.
+
+    Every child runs in its own session, so that stopping it also stops the
+    processes it started. `close` stops all children, and is called when the
+    service stops.
+
+    """
+
+    def __init__(self, max_concurrency=8, kill_timeout=5.0):
+        """Initializes a new instance of the SubprocessPool class.
+
+        Args:
+            max_concurrency (int):
+                The maximum amount of child processes running at the same time.
+            kill_timeout (float):
+                Seconds a child gets to exit after SIGTERM, before it is killed.
+        """
+
+        self.max_concurrency = max_concurrency
+        self.kill_timeout = kill_timeout
+
+        self._lock = threading.Lock()
+        self._running = []
+        self._pending = collections.deque()
+        self._closed = False
+        self._thread = None
+        self._wakeup = None
+        self._selector = None
+
+    @property
+    def running(self):
+        """The amount of child processes that are running."""
+
+        return len(self._running)
+
+    @property
+    def pending(self):
+        """The amount of child processes waiting to be started."""
+
+        return len(self._pending)
+
+    def spawn(self, args, timeout=None, callback=None, **kwargs):
+        """Starts a child process, or queues it when the pool is at its concurrency limit.
+
+        Args:
+            args (list):
+                The program to run and its arguments.
+            timeout (float):
+                The maximum amount of seconds the process may run, after which it
+                is stopped, or None for no limit.
+            callback (callable):
+                Called from the background thread with the ManagedProcess, once the
+                process exited.
+            **kwargs:
+                Additional keyword arguments for `subprocess.Popen`.
+
+        Returns:
+            An instance of the ManagedProcess class.
+        """
+
+        managed = ManagedProcess(args, timeout, callback, kwargs)
+
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('Subprocess pool is closed')
+
+            self._ensure_thread()
+
+            started = True
+            if len(self._running) < self.max_concurrency:
+                started = self._start(managed)
+            else:
+                self._pending.append(managed)
+
+        if not started:
+            self._finish(managed)
+
+        self._wake()
+        return managed
+
+    def close(self):
+        """Stops all child processes and cancels the queued ones.
+
+        Sends SIGTERM to every running child, and SIGKILL to those that did not
+        exit within `kill_timeout` seconds. Blocks until all children are reaped.
+        """
+
+        with self._lock:
+            if self._closed:
+                return
+
+            self._closed = True
+            cancelled = list(self._pending)
+            self._pending.clear()
+
+            deadline = time.monotonic() + self.kill_timeout
+            for managed in self._running:
+                self._signal(managed, signal.SIGTERM)
+                managed.deadline = min(managed.deadline or deadline, deadline)
+
+        for managed in cancelled:
+            self._finish(managed)
+
+        if self._thread:
+            self._wake()
+            self._thread.join()
+
+    def _ensure_thread(self):
+        """Starts the background thread, if it is not running yet. Must be called with the lock held."""
+
+        if self._thread:
+            return
+
+        self._wakeup = os.pipe()
+        for fd in self._wakeup:
+            os.set_blocking(fd, False)
+
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._wakeup[0], selectors.EVENT_READ)
+
+        self._thread = threading.Thread(target=self._reap_loop, name='pyservice-subprocesses', daemon=True)
+        self._thread.start()
+
+    def _start(self, managed):
+        """Starts a child process. Must be called with the lock held.
+
+        Returns:
+            True when the process was started, false when it could not be spawned.
+        """
+
+        kwargs = dict(managed.kwargs)
+        kwargs.setdefault('start_new_session', True)
+
+        try:
+            managed.process = subprocess.Popen(managed.args, **kwargs)
+        except OSError as error:
+            logger.error('Unable to spawn `%s`: %s', managed.args, error)
+            managed.returncode = -1
+            return False
+
+        if managed.timeout is not None:
+            managed.deadline = time.monotonic() + managed.timeout
+
+        # Without pidfds, the background thread polls the children
+        if hasattr(os, 'pidfd_open'):
+            try:
+                managed.pidfd = os.pidfd_open(managed.process.pid)
+                self._selector.register(managed.pidfd, selectors.EVENT_READ, managed)
+            except OSError:
+                managed.pidfd = None
+
+        self._running.append(managed)
+        return True
+
+    def _reap_loop(self):
+        """Background thread that waits for the children to exit and enforces their timeouts."""
+
+        while True:
+            with self._lock:
+                if self._closed and not self._running:
+                    break
+
+                timeout = self._next_timeout()
+
+            self._selector.select(timeout)
+
+            try:
+                while os.read(self._wakeup[0], 512):
+                    pass
+            except BlockingIOError:
+                pass
+
+            with self._lock:
+                finished = self._collect()
+
+            for managed in finished:
+                self._finish(managed)
+
+        self._selector.close()
+        for fd in self._wakeup:
+            os.close(fd)
+
+    def _next_timeout(self):
+        """Gets the amount of seconds until the next deadline. Must be called with the lock held."""
+
+        timeouts = [managed.deadline - time.monotonic() for managed in self._running if managed.deadline]
+
+        # Poll children that could not be given a pidfd
+        if any(managed.pidfd is None for managed in self._running):
+            timeouts.append(0.05)
+
+        return max(min(timeouts), 0) if timeouts else None
+
+    def _collect(self):
+        """Reaps exited children, enforces deadlines and starts queued children.
+
+        Must be called with the lock held.
+
+        Returns:
+            The children that exited, or could not be started.
+        """
+
+        finished = []
+        now = time.monotonic()
+
+        for managed in list(self._running):
+            if managed.process.poll() is not None:
+                self._running.remove(managed)
+                if managed.pidfd is not None:
+                    self._selector.unregister(managed.pidfd)
+                    os.close(managed.pidfd)
+                managed.returncode = managed.process.returncode
+                finished.append(managed)
+
+            elif managed.deadline and now >= managed.deadline:
+                # First ask nicely, then stop asking
+                if managed.timed_out or self._closed:
+                    self._signal(managed, signal.SIGKILL)
+                    managed.deadline = None
+                else:
+                    logger.warning('`%s` (%d) timed out, stopping it', managed.args, managed.pid)
+                    self._signal(managed, signal.SIGTERM)
+                    managed.timed_out = True
+                    managed.deadline = now + self.kill_timeout
+
+        while self._pending and len(self._running) < self.max_concurrency:
+            managed = self._pending.popleft()
+            if not self._start(managed):
+                finished.append(managed)
+
+        return finished
+
+    def _finish(self, managed):
+        """Marks a child as done and calls its callback."""
+
+        managed._done.set()
+
+        if managed.callback:
+            try:
+                managed.callback(managed)
+            except Exception:
+                logger.exception('Callback for `%s` failed', managed.args)
+
+    def _signal(self, managed, signum):
+        """Sends a signal to a child and the processes in its session."""
+
+        try:
+            if managed.kwargs.get('start_new_session', True):
+                os.killpg(managed.pid, signum)
+            else:
+                os.kill(managed.pid, signum)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def _wake(self):
+        """Wakes up the background thread."""
+
+        if self._wakeup:
+            try:
+                os.write(self._wakeup[1], b'\0')
+            except (BlockingIOError, OSError):
+                pass
@@ -0,0 +1,1434 @@
+######################################################################################
+#
+#   This file is part of PyService.
+#
+#   PyService is free software: you can redistribute it and/or modify it under the
+#   terms of the GNU General Public License as published by the Free Software
+#   Foundation, version 2.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#   FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#   details.
+#
+#   You should have received a copy of the GNU General Public License along with
+#   this program; if not, write to the Free Software Foundation, Inc., 51
+#   Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#   Copyright: Swen Kooij (Photonios) <photonios@outlook.com>
+#
+#####################################################################################
+
+import os
+import sys
+import json
+import math
+import mmap
+import time
+import signal
+import socket
+import logging
+import selectors
+import threading
+import traceback
+import collections
+from . import procstat
+from .history import ResourceHistory, TIME, CPU
+from .control import ControlServer, JsonChannel, serve_channel
+
+logger = logging.getLogger(__name__)
+
+# Fields of a slot in the worker table
+PID = 0
+STATE = 1
+QUEUE_LENGTH = 2
+IN_FLIGHT = 3
+DISPATCHED = 4
+RECEIVED = 5
+READY = 6
+REQUESTS = 7
+FIELD_COUNT = 8
+
+# States a slot in the worker table can be in
+FREE = 0
+RUNNING = 1
+DRAINING = 2
+
+# Signals the supervisor passes on to all of its workers, that exist on this platform
+FORWARDED_SIGNALS = tuple(getattr(signal, name) for name in ('SIGUSR1', 'SIGUSR2') if hasattr(signal, name))
+
+# Seconds a worker gets to answer a request on its control channel
+REQUEST_TIMEOUT = 10.0
+
+# Environment variable that describes a worker the supervisor executed to the new process
+WORKER_ENVIRONMENT = 'PYSERVICE_WORKER'
+
+def notify(state):
+    """Notifies the service manager (systemd or a container runtime) of a state change.
+
+    Uses the sd_notify protocol, does nothing when `NOTIFY_SOCKET` is not set.
+
+    Args:
+        state (str):
+            The state to report, for example `READY=1` or `STOPPING=1`.
+    """
+
+    address = os.environ.get('NOTIFY_SOCKET')
+    if not address:
+        return
+
+    # Addresses starting with @ are in the abstract namespace
+    if address.startswith('@'):
+        address = '\0' + address[1:]
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.sendto(state.encode(), address)
+    except OSError as error:
+        logger.warning('Unable to notify the service manager: %s', error)
+
+class WorkerTable(object):
+    """Fixed-size table of worker slots, shared between the supervisor and its workers.
+
+    The table lives in shared memory (a memfd) that is created before the workers
+    are forked, so the workers and the supervisor read and write the same memory
+    without any message passing. Workers that are executed rather than forked map
+    the same memory through the file descriptor they inherit. Every slot is a row
+    of 64-bit integers.
+
+    """
+
+    def __init__(self, size, fd=None):
+        """Initializes a new instance of the WorkerTable class.
+
+        Args:
+            size (int):
+                The amount of slots in the table.
+            fd (int):
+                File descriptor of the memory of an existing table, when None
+                a new table is created.
+        """
+
+        self.size = size
+
+        if fd is None:
+            fd = os.memfd_create('pyservice-workers')
+            os.ftruncate(fd, size * FIELD_COUNT * 8)
+
+        self.fd = fd
+        self._memory = mmap.mmap(fd, size * FIELD_COUNT * 8)
+        self._values = memoryview(self._memory).cast('q')
+
+    def get(self, index, field):
+        """Gets the value of a field of the slot at the specified index."""
+
+        return self._values[index * FIELD_COUNT + field]
+
+    def set(self, index, field, value):
+        """Sets the value of a field of the slot at the specified index."""
+
+        self._values[index * FIELD_COUNT + field] = value
+
+    def acquire(self):
+        """Claims a free slot.
+
+        Returns:
+            The index of the claimed slot, or None when all slots are in use.
+        """
+
+        for index in range(self.size):
+            if self.get(index, STATE) == FREE:
+                self.release(index)
+                self.set(index, STATE, RUNNING)
+                return index
+
+        return None
+
+    def release(self, index):
+        """Clears the slot at the specified index, so it can be claimed again."""
+
+        for field in range(FIELD_COUNT):
+            self.set(index, field, 0)
+
+    def find(self, pid):
+        """Finds the slot of the worker with the specified PID.
+
+        Returns:
+            The index of the slot, or None when there is no worker with this PID.
+        """
+
+        for index in range(self.size):
+            if self.get(index, STATE) != FREE and self.get(index, PID) == pid:
+                return index
+
+        return None
+
+    def indices(self, state):
+        """Gets the indices of all slots in the specified state."""
+
+        return [index for index in range(self.size) if self.get(index, STATE) == state]
+
+class WorkerSlot(object):
+    """The slot in the worker table that belongs to the current worker process.
+
+    Every field is written by one process only, either the worker or the
+    supervisor, so updates never need to be synchronized between processes.
+
+    """
+
+    def __init__(self, table, index):
+        """Initializes a new instance of the WorkerSlot class.
+
+        Args:
+            table (WorkerTable):
+                The table the slot is part of.
+            index (int):
+                The index of the slot in the table.
+        """
+
+        self.table = table
+        self.index = index
+        self._lock = threading.Lock()
+
+    def get(self, field):
+        """Gets the value of a field of this slot."""
+
+        return self.table.get(self.index, field)
+
+    def set(self, field, value):
+        """Sets the value of a field of this slot."""
+
+        self.table.set(self.index, field, value)
+
+    def add(self, field, delta):
+        """Adds to the value of a field of this slot, safe to call from multiple threads."""
+
+        with self._lock:
+            self.table.set(self.index, field, self.table.get(self.index, field) + delta)
+
+class RollingRestart(object):
+    """Progress of a rolling restart, which replaces the running workers a batch at a time.
+
+    Workers are identified by their PID, as slots are reused while the restart
+    is in progress.
+
+    """
+
+    def __init__(self, old, batch_size, min_ready, reply, rollback=False):
+        """Initializes a new instance of the RollingRestart class.
+
+        Args:
+            old (list):
+                The PIDs of the workers to replace.
+            batch_size (int):
+                The maximum amount of workers to replace at a time.
+            min_ready (int):
+                The minimum amount of ready workers to keep while replacing workers.
+            reply (callable):
+                Called with the result, once the restart completed or failed.
+            rollback (bool):
+                True when this restart rolls back a failed one, the new workers are
+                then forked from the supervisor and a failure is not rolled back.
+        """
+
+        self.old = list(old)
+        self.batch_size = batch_size
+        self.min_ready = min_ready
+        self.reply = reply
+        self.rollback = rollback
+
+        # New workers of the current batch (PID -> [healthy, deadline]), the amount
+        # of them that still has to be spawned and the old workers they replace
+        self.batch = {}
+        self.to_spawn = 0
+        self.to_drain = []
+
+        # New workers of the batches that completed
+        self.replaced = []
+
+class PyServiceSupervisor(object):
+    """Runs a service in a pool of worker processes.
+
+    The supervisor binds the listening sockets of the service, forks the workers
+    (which all inherit the sockets and call `started`) and then keeps an eye on
+    them. Workers that die are replaced, and at a fixed interval the load of the
+    workers is sampled and handed to the autoscaler of the service, which decides
+    whether workers should be added or drained.
+
+    Draining a worker is done by sending it SIGTERM, which calls `stopped` in the
+    worker. When the worker did not exit within `drain_timeout` seconds, it is killed.
+
+    Commands for the running service arrive on the control socket of the service.
+    A `reconfigure` command (or SIGHUP, which reloads the configuration file) is
+    validated and then passed on to every worker over its own control channel. Only
+    when all workers accepted the new configuration it is committed, otherwise the
+    workers that did accept it are reconfigured back to the old configuration.
+
+    Signals the supervisor receives (other than SIGTERM and SIGINT, which stop it,
+    and SIGHUP) are forwarded to the workers, and it collects the exit status of any of its
+    children, including orphans that were handed to it, so it can run as PID 1.
+    Once the first workers are ready, the supervisor reports readiness to the
+    service manager (see `notify`).
+
+    Workers that exit unexpectedly are replaced after a delay, which grows with
+    every unexpected exit, so a worker that fails on startup is not respawned in
+    a tight loop. When too many workers exit unexpectedly within a short time
+    (see `max_crashes`), the supervisor stops with exit status 1, so the failure
+    reaches the service manager or container runtime.
+
+    When the workers were idle for `idle_timeout` seconds (or the autoscaler scales
+    down to zero workers), all workers are drained and the supervisor parks: it
+    keeps the listening sockets open, and the first connection that comes in
+    spawns the workers again, which then accept the queued connection. The time
+    from that connection to the workers having accepted it is logged and kept in
+    `wake_latencies`.
+
+    In dispatch mode, the workers do not share the listening sockets. Instead, the
+    supervisor accepts the connections and passes them (SCM_RIGHTS) over a unix
+    socket to the worker with the least amount of work in flight, which is the
+    amount of requests the worker reported as in flight plus the connections that
+    were dispatched to it but not received yet.
+
+    Every sample also records the resource usage of each worker (from /proc) in
+    `history`, which has a fixed size. The `top` command replies with the rates
+    of each worker over that history, which is what `--top` shows.
+
+    A `rolling-restart` command replaces the workers a batch at a time, while the
+    amount of workers is not scaled. The new workers are executed rather than forked,
+    so they run the code that is on disk (and so do the workers spawned after the
+    restart completed). Each batch has to become ready and pass the health check of
+    the service before the old workers it replaces are drained, and old workers are
+    only drained up front when that keeps enough workers ready. When a new worker
+    fails, the workers that were already replaced are replaced again by workers
+    forked from the supervisor, which runs the code the service was started with,
+    and so are the workers spawned afterwards. Services that run from a bundle
+    (see `bundle_on_install`) cannot be restarted this way.
+
+    """
+
+    def __init__(self, service):
+        """Initializes a new instance of the PyServiceSupervisor class.
+
+        Args:
+            service (PyService):
+                The service to supervise.
+        """
+
+        self.service = service
+        self.autoscaler = service.create_autoscaler()
+
+        # A parked supervisor waits for a connection on its listening sockets,
+        # without any it would never wake up again
+        if not service.listen and (service.idle_timeout or self.autoscaler.min_workers < 1):
+            raise ValueError('Stopping idle workers (idle_timeout or min_workers < 1) requires `listen` addresses')
+        self.table = WorkerTable(service.max_workers)
+        self.history = ResourceHistory(self.table.size, service.history_length)
+        self.sockets = []
+        self.target = self.autoscaler.min_workers
+        self.exit_status = 0
+        self.crashes = 0
+        self.wake_latencies = []
+
+        self._stopping = False
+        self._ready = False
+        self._parked = self.target == 0
+        self._last_activity = time.monotonic()
+        self._last_requests = 0
+        self._woken_at = None
+        self._drain_deadlines = {}
+        self._crash_times = collections.deque()
+        self._respawn_at = 0.0
+        self._wakeup = None
+        self._selector = None
+        self._channels = {}
+        self._listening = False
+        self._control = None
+        self._controls = {}
+        self._requests = {}
+        self._reload = False
+        self._rollout = None
+        self._exec_workers = False
+
+    def run(self):
+        """Runs the supervisor until it is asked to stop.
+
+        Returns:
+            True when the supervisor and all of its workers stopped cleanly, the
+            exit status is available as `exit_status` afterwards.
+        """
+
+        # Bind the sockets before forking, so all workers share them,
+        # unless connections are dispatched by the supervisor
+        for address in self.service.listen:
+            self.sockets.append(self._bind(address))
+
+        if not self.service.dispatch:
+            self.service.sockets = self.sockets
+
+        # Any signal wakes up the loop through this pipe
+        self._wakeup = os.pipe()
+        for fd in self._wakeup:
+            os.set_blocking(fd, False)
+
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._wakeup[0], selectors.EVENT_READ)
+
+        signal.set_wakeup_fd(self._wakeup[1])
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+        signal.signal(signal.SIGHUP, self._handle_reload)
+        for signum in FORWARDED_SIGNALS:
+            signal.signal(signum, self._forward)
+
+        if self.service.control_socket:
+            self._control = ControlServer(self.service.control_socket, self._handle_command)
+            if not self._control.open(self._selector):
+                self._control = None
+
+        logger.info('Supervising %s with %d - %d workers', self.service.name,
+                    self.autoscaler.min_workers, self.autoscaler.max_workers)
+
+        try:
+            next_sample = time.monotonic()
+            while not self._stopping:
+                now = time.monotonic()
+                if now >= next_sample:
+                    # Replace workers that died before sampling, so the
+                    # autoscaler sees the actual capacity
+                    self._reconcile(now)
+                    self._sample(now)
+                    self._reconcile(now)
+                    next_sample = now + self.service.sample_interval
+
+                if self._reload:
+                    self._reload = False
+                    self._reload_config()
+
+                # Check for readiness often until ready (or while new workers of
+                # a rolling restart become ready), so startup stays quick
+                timeout = max(next_sample - time.monotonic(), 0)
+                if not self._ready or self._woken_at or self._rollout:
+                    timeout = min(timeout, 0.05)
+                self._poll(timeout)
+
+            if self._rollout:
+                rollout, self._rollout = self._rollout, None
+                rollout.reply({'ok': False, 'error': 'The service is stopping'})
+
+            # Drain all workers and wait for them to exit
+            notify('STOPPING=1')
+            self.target = 0
+            self._reconcile(time.monotonic())
+            while self._drain_deadlines:
+                self._poll(0.1)
+
+        finally:
+            signal.set_wakeup_fd(-1)
+            if self._control:
+                self._control.close()
+            for channel in list(self._controls.values()):
+                channel.close()
+            self._selector.close()
+            for fd in self._wakeup:
+                os.close(fd)
+            for channel in self._channels.values():
+                channel.close()
+
+        return self.exit_status == 0
+
+    def _bind(self, address):
+        """Creates a listening socket that is shared by all workers.
+
+        Args:
+            address (tuple):
+                The (host, port) to listen on.
+
+        Returns:
+            The non-blocking, listening socket.
+        """
+
+        family = socket.AF_INET6 if ':' in address[0] else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(address)
+        sock.listen(self.service.listen_backlog)
+        sock.setblocking(False)
+        return sock
+
+    def _poll(self, timeout):
+        """Waits for a signal or a connection to dispatch and handles what happened.
+
+        Args:
+            timeout (float):
+                The maximum amount of seconds to wait.
+        """
+
+        self._update_listening()
+
+        # Keys with data are control sockets, with a function to call
+        for key, events in self._selector.select(timeout):
+            if key.fileobj == self._wakeup[0]:
+                self._clear_wakeup()
+            elif key.data:
+                key.data()
+            elif self._parked or not self.service.dispatch:
+                # Wake up once, the workers accept the connections on the other
+                # sockets that were ready, unless they are dispatched
+                if self._parked:
+                    self._wake_up(time.monotonic())
+            else:
+                self._dispatch(key.fileobj)
+
+        self._reap()
+        self._enforce_drain_deadlines()
+        self._expire_requests()
+        self._advance_rollout(time.monotonic())
+        self._check_ready()
+        self._check_woken()
+
+    def _check_ready(self):
+        """Reports readiness once, as soon as the initial amount of workers is ready.
+
+        A parked supervisor is ready right away, its sockets are listening.
+        """
+
+        if self._ready or self._stopping:
+            return
+
+        ready = [index for index in self.table.indices(RUNNING) if self.table.get(index, READY)]
+        if len(ready) < max(self.target, 1) and not self._parked:
+            return
+
+        logger.info('%s is ready with %d workers', self.service.name, len(ready))
+        notify('READY=1\nMAINPID=%d' % os.getpid())
+        self._ready = True
+
+    def _check_woken(self):
+        """Measures how long it took to serve the connection that woke up the supervisor.
+
+        The connection is served once a worker is ready and the accept backlog is empty.
+        """
+
+        if not self._woken_at:
+            return
+
+        ready = [index for index in self.table.indices(RUNNING) if self.table.get(index, READY)]
+        if not ready or any(procstat.read_listen_backlog(sock) for sock in self.sockets):
+            return
+
+        latency = time.monotonic() - self._woken_at
+        logger.info('Accepted the waiting connections %.1f ms after waking up', latency * 1000)
+        self.wake_latencies.append(latency)
+        self._woken_at = None
+
+    def _update_listening(self):
+        """Watches the listening sockets when the supervisor has to act on new connections.
+
+        That is when parked, to wake up, and in dispatch mode while there are
+        workers to dispatch to. Otherwise, connections stay in the accept backlog.
+        """
+
+        if self._stopping:
+            listening = False
+        elif self._parked:
+            listening = True
+        else:
+            listening = self.service.dispatch and bool(self.table.indices(RUNNING))
+
+        if listening == self._listening:
+            return
+
+        for sock in self.sockets:
+            if listening:
+                self._selector.register(sock, selectors.EVENT_READ)
+            else:
+                self._selector.unregister(sock)
+
+        self._listening = listening
+
+    def _park(self, reason):
+        """Drains all workers and waits for a connection to come in before spawning them again."""
+
+        logger.info('Parking, %s', reason)
+        self._parked = True
+        self.target = 0
+
+    def _wake_up(self, now):
+        """Spawns the workers again after a connection came in while parked."""
+
+        logger.info('Waking up, a connection is waiting')
+        self._parked = False
+        self._woken_at = now
+        self._last_activity = now
+        self.target = max(self.autoscaler.min_workers, 1)
+        self._reconcile(now)
+
+    def _dispatch(self, sock):
+        """Accepts all pending connections and passes each to the least loaded worker.
+
+        Args:
+            sock (socket.socket):
+                The listening socket that has connections pending.
+        """
+
+        while True:
+            try:
+                connection, address = sock.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+
+            try:
+                # Try the workers from least to most loaded, when a worker
+                # cannot take the connection (channel full or gone), move on
+                for index in sorted(self.table.indices(RUNNING), key=self._load):
+                    try:
+                        socket.send_fds(self._channels[index], [b'c'], [connection.fileno()])
+                    except OSError:
+                        continue
+
+                    self.table.set(index, DISPATCHED, self.table.get(index, DISPATCHED) + 1)
+                    break
+                else:
+                    logger.warning('Unable to dispatch connection from %s, no worker accepted it', address)
+            finally:
+                connection.close()
+
+    def _load(self, index):
+        """Gets the amount of work in flight for the worker in the specified slot."""
+
+        pending = self.table.get(index, DISPATCHED) - self.table.get(index, RECEIVED)
+        return self.table.get(index, IN_FLIGHT) + pending
+
+    def _handle_stop(self, signum, frame):
+        """Signal handler for SIGTERM and SIGINT, stops the supervisor."""
+
+        self._stopping = True
+
+    def _handle_reload(self, signum, frame):
+        """Signal handler for SIGHUP, reloads the configuration on the next iteration of the loop."""
+
+        self._reload = True
+
+    def _handle_command(self, command, reply):
+        """Handles a command that arrived on the control socket.
+
+        Args:
+            command (dict):
+                The command.
+            reply (callable):
+                Sends the reply to the client, possibly after this function returned.
+        """
+
+        name = command.get('command')
+
+        if name == 'reconfigure':
+            self._reconfigure(command.get('config'), reply)
+        elif name == 'rolling-restart':
+            self._rolling_restart(command, reply)
+        elif name == 'status':
+            reply({'ok': True, 'crashes': self.crashes,
+                   'workers': [self._status(index) for index in range(self.table.size)
+                               if self.table.get(index, STATE) != FREE]})
+        elif name == 'top':
+            reply({'ok': True, 'name': self.service.name, 'interval': self.service.sample_interval,
+                   'workers': [dict(self._status(index), usage=self.history.rates(index))
+                               for index in range(self.table.size) if self.table.get(index, STATE) != FREE]})
+        else:
+            reply({'ok': False, 'error': 'Unknown command `%s`' % name})
+
+    def _status(self, index):
+        """Gets the status of the worker in the specified slot, for the `status` command."""
+
+        return {
+            'slot': index,
+            'pid': self.table.get(index, PID),
+            'state': {RUNNING: 'running', DRAINING: 'draining'}.get(self.table.get(index, STATE)),
+            'ready': bool(self.table.get(index, READY)),
+            'in_flight': self.table.get(index, IN_FLIGHT),
+            'queue_length': self.table.get(index, QUEUE_LENGTH),
+            'requests': self.table.get(index, REQUESTS)
+        }
+
+    def _reload_config(self):
+        """Reloads the configuration of the service and applies it to all workers."""
+
+        try:
+            config = self.service.load_config()
+        except Exception as error:
+            logger.error('Unable to reload the configuration: %s', error)
+            return
+
+        def reply(result):
+            if not result['ok']:
+                logger.error('Unable to reload the configuration: %s', result['error'])
+
+        self._reconfigure(config, reply)
+
+    def _reconfigure(self, config, reply):
+        """Applies a new configuration to all workers, or to none of them.
+
+        The configuration is validated first, then every running worker applies it.
+        When one of them rejects it, the others are reconfigured back to the old
+        configuration. Workers that are spawned while the workers answer inherit
+        the old configuration, the committed configuration is pushed to them
+        afterwards. Workers that fail to apply the configuration they are pushed
+        afterwards, or to roll back, are replaced.
+
+        Args:
+            config (dict):
+                The new configuration.
+            reply (callable):
+                Called with the result, once all workers answered.
+        """
+
+        old = self.service.config
+
+        try:
+            self.service.validate_config(config)
+            autoscaler_bounds = self._validate_bounds(config)
+        except Exception as error:
+            reply({'ok': False, 'error': 'Invalid configuration: %s' % error})
+            return
+
+        # Workers are identified by their PID as well, as slots are reused
+        workers = dict((index, self.table.get(index, PID)) for index in self.table.indices(RUNNING))
+        pending = set(workers)
+        accepted = []
+        errors = []
+
+        def finish():
+            if errors:
+                for index in accepted:
+                    self._request(index, {'command': 'reconfigure', 'config': old},
+                                  self._reconfigured(workers[index], 'Unable to roll back the configuration of'))
+                logger.warning('Configuration rejected, rolled back %d workers: %s',
+                               len(accepted), '; '.join(errors))
+                reply({'ok': False, 'error': '; '.join(errors)})
+                return
+
+            self.autoscaler.min_workers, self.autoscaler.max_workers = autoscaler_bounds
+            self.service._apply_builtin_config(config)
+            self.service.config = config
+
+            for index in self.table.indices(RUNNING):
+                pid = self.table.get(index, PID)
+                if workers.get(index) != pid:
+                    self._request(index, {'command': 'reconfigure', 'config': config},
+                                  self._reconfigured(pid, 'Unable to reconfigure new'))
+
+            logger.info('Reconfigured %d workers', len(accepted))
+            reply({'ok': True})
+
+        def answered(index, result):
+            pending.discard(index)
+            if result.get('ok'):
+                accepted.append(index)
+            else:
+                errors.append('worker %d: %s' % (workers[index], result.get('error')))
+
+            if not pending:
+                finish()
+
+        if not pending:
+            finish()
+            return
+
+        for index in list(pending):
+            self._request(index, {'command': 'reconfigure', 'config': config}, answered)
+
+    def _reconfigured(self, pid, message):
+        """Creates the callback for the reply of a worker that has to apply a configuration.
+
+        A worker that does not apply it runs another configuration than the
+        others, so it is drained and (by `_reconcile`) replaced by a new worker.
+
+        Args:
+            pid (int):
+                The PID of the worker.
+            message (str):
+                Logged, followed by the worker and the error, when the worker fails.
+        """
+
+        def callback(index, result):
+            if result.get('ok'):
+                return
+
+            logger.error('%s worker %d, replacing it: %s', message, pid, result.get('error'))
+            if self.table.get(index, STATE) == RUNNING and self.table.get(index, PID) == pid:
+                self._drain(index, time.monotonic())
+
+        return callback
+
+    def _validate_bounds(self, config):
+        """Validates the worker bounds in a configuration.
+
+        Returns:
+            A tuple of the minimum and maximum amount of workers to use.
+        """
+
+        minimum = config.get('min_workers', self.autoscaler.min_workers)
+        maximum = config.get('max_workers', self.autoscaler.max_workers)
+
+        if minimum < 0 or minimum > maximum or maximum > self.table.size:
+            raise ValueError('Worker bounds must be within 0 - %d' % self.table.size)
+
+        if minimum < 1 and not self.sockets:
+            raise ValueError('Scaling to zero workers requires `listen` addresses')
+
+        return minimum, maximum
+
+    def _rolling_restart(self, command, reply):
+        """Starts replacing all running workers by new ones, a batch at a time.
+
+        Args:
+            command (dict):
+                The command, `batch_size` and `min_capacity` (the fraction of the
+                workers to keep ready) override the settings of the service.
+            reply (callable):
+                Called with the result, once the restart completed or was rolled back.
+        """
+
+        if self._rollout:
+            reply({'ok': False, 'error': 'A rolling restart is already in progress'})
+            return
+
+        # New workers would start the same bundle again, and it cannot be replaced
+        # while the running workers still import modules from it
+        import zipfile
+        if zipfile.is_zipfile(sys.argv[0]):
+            reply({'ok': False, 'error': 'The service runs from a bundle (bundle_on_install), which a rolling '
+                                         'restart cannot update, reinstall and restart the service instead'})
+            return
+
+        batch_size = command.get('batch_size', self.service.rolling_batch_size)
+        min_capacity = command.get('min_capacity', self.service.rolling_min_capacity)
+        if batch_size < 1 or not 0 <= min_capacity <= 1:
+            reply({'ok': False, 'error': 'Batch size must be at least 1 and minimum capacity within 0 - 1'})
+            return
+
+        old = [self.table.get(index, PID) for index in self.table.indices(RUNNING)]
+
+        # Without workers (parked), only the workers spawned later are affected
+        if not old:
+            self._exec_workers = True
+            reply({'ok': True, 'replaced': 0})
+            return
+
+        logger.info('Rolling restart of %d workers, %d at a time', len(old), batch_size)
+        self._rollout = RollingRestart(old, batch_size, math.ceil(min_capacity * len(old)), reply)
+        self._advance_rollout(time.monotonic())
+
+    def _advance_rollout(self, now):
+        """Moves the rolling restart that is in progress (if any) forward.
+
+        Args:
+            now (float):
+                Monotonic timestamp, used for the deadlines of the new workers.
+        """
+
+        rollout = self._rollout
+        if not rollout:
+            return
+
+        # Spawn the new workers of the current batch as slots become free
+        while rollout.to_spawn and self.table.indices(FREE):
+            index = self._spawn(execute=not rollout.rollback)
+            if index is None:
+                self._fail_rollout('Unable to spawn a new worker')
+                return
+
+            rollout.batch[self.table.get(index, PID)] = [False, now + self.service.rolling_health_timeout]
+            rollout.to_spawn -= 1
+
+        for pid, (healthy, deadline) in list(rollout.batch.items()):
+            index = self.table.find(pid)
+            if index is None or self.table.get(index, STATE) != RUNNING:
+                self._fail_rollout('New worker %d exited' % pid)
+                return
+
+            if healthy is True:
+                continue
+
+            if now >= deadline:
+                self._fail_rollout('New worker %d did not become healthy within %d seconds' %
+                                   (pid, self.service.rolling_health_timeout))
+                return
+
+            # Probe the health of the worker once it is ready
+            if healthy is False and self.table.get(index, READY):
+                rollout.batch[pid][0] = None
+                self._request(index, {'command': 'health'}, self._probed(rollout, pid))
+                if self._rollout is not rollout:
+                    return
+
+        if rollout.to_spawn or any(healthy is not True for healthy, deadline in rollout.batch.values()):
+            return
+
+        # The batch is healthy, the old workers it replaces can go
+        for pid in rollout.to_drain:
+            index = self.table.find(pid)
+            if index is not None and self.table.get(index, STATE) == RUNNING:
+                self._drain(index, now)
+
+        rollout.replaced.extend(rollout.batch)
+        rollout.batch = {}
+        rollout.to_drain = []
+
+        # Old workers that exited in the meantime are not replaced
+        running = [self.table.get(index, PID) for index in self.table.indices(RUNNING)]
+        rollout.old = [pid for pid in rollout.old if pid in running]
+        if not rollout.old:
+            self._finish_rollout()
+            return
+
+        # Start new workers in the free slots first, old workers are only
+        # drained before their replacement is up when enough workers stay ready
+        ready = len([index for index in self.table.indices(RUNNING) if self.table.get(index, READY)])
+        size = min(rollout.batch_size, len(rollout.old))
+        surge = min(size, len(self.table.indices(FREE)))
+        drain = min(size - surge, max(ready - rollout.min_ready, 0))
+
+        if surge + drain == 0:
+            # Draining workers free up their slots once they exited
+            if not self._drain_deadlines:
+                self._fail_rollout('Unable to replace workers without dropping below %d ready workers' %
+                                   rollout.min_ready)
+            return
+
+        old, rollout.old = rollout.old[:surge + drain], rollout.old[surge + drain:]
+        for pid in old[:drain]:
+            self._drain(self.table.find(pid), now)
+
+        rollout.to_drain = old[drain:]
+        rollout.to_spawn = surge + drain
+        logger.info('Replacing %d workers, %d remaining', len(old), len(rollout.old))
+        self._advance_rollout(now)
+
+    def _probed(self, rollout, pid):
+        """Creates the callback for the reply to a health probe of a new worker."""
+
+        def callback(index, result):
+            if self._rollout is not rollout or pid not in rollout.batch:
+                return
+
+            if result.get('ok'):
+                rollout.batch[pid][0] = True
+                self._advance_rollout(time.monotonic())
+            else:
+                self._fail_rollout('New worker %d is not healthy: %s' % (pid, result.get('error')))
+
+        return callback
+
+    def _finish_rollout(self):
+        """Completes the rolling restart that is in progress."""
+
+        rollout, self._rollout = self._rollout, None
+
+        # Workers that are spawned later run the new code as well
+        if rollout.rollback:
+            logger.info('Rolled back %d workers', len(rollout.replaced))
+        else:
+            self._exec_workers = True
+            logger.info('Rolling restart replaced %d workers', len(rollout.replaced))
+
+        rollout.reply({'ok': True, 'replaced': len(rollout.replaced)})
+
+    def _fail_rollout(self, reason):
+        """Aborts the rolling restart that is in progress and rolls back the workers it replaced.
+
+        Args:
+            reason (str):
+                Why the rolling restart failed.
+        """
+
+        rollout, self._rollout = self._rollout, None
+        logger.warning('Rolling restart failed: %s', reason)
+
+        # Only the code of the supervisor is known to work now
+        self._exec_workers = False
+
+        now = time.monotonic()
+        for pid in rollout.batch:
+            index = self.table.find(pid)
+            if index is not None and self.table.get(index, STATE) == RUNNING:
+                self._drain(index, now)
+
+        if rollout.rollback or not rollout.replaced:
+            rollout.reply({'ok': False, 'error': reason})
+            return
+
+        def rolled_back(result):
+            if result['ok']:
+                rollout.reply({'ok': False, 'error': '%s, rolled back %d workers' % (reason, result['replaced'])})
+            else:
+                rollout.reply({'ok': False, 'error': '%s, rollback failed: %s' % (reason, result['error'])})
+
+        self._rollout = RollingRestart(rollout.replaced, rollout.batch_size, rollout.min_ready,
+                                       rolled_back, rollback=True)
+        self._advance_rollout(now)
+
+    def _request(self, index, request, callback):
+        """Sends a request to a worker over its control channel.
+
+        Args:
+            index (int):
+                The index of the slot of the worker.
+            request (dict):
+                The request.
+            callback (callable):
+                Called with the index and the reply of the worker, or with an error
+                when the worker did not answer.
+        """
+
+        channel = self._controls.get(index)
+        if not channel:
+            callback(index, {'ok': False, 'error': 'No control channel'})
+            return
+
+        self._requests.setdefault(index, collections.deque()).append(
+            (callback, time.monotonic() + REQUEST_TIMEOUT))
+        channel.send(request)
+
+    def _handle_reply(self, index, reply):
+        """Passes a reply from a worker to the callback of the oldest request."""
+
+        requests = self._requests.get(index)
+        if requests:
+            callback, deadline = requests.popleft()
+            callback(index, reply)
+
+    def _close_control(self, index):
+        """Closes the control channel of a worker and fails its outstanding requests."""
+
+        channel = self._controls.pop(index, None)
+        if channel:
+            channel.close()
+
+        for callback, deadline in self._requests.pop(index, ()):
+            callback(index, {'ok': False, 'error': 'Worker did not answer'})
+
+    def _expire_requests(self):
+        """Replaces workers that did not answer a request in time.
+
+        Without its control channel, a worker can no longer be reconfigured or
+        probed, so it is drained and (by `_reconcile`) replaced by a new worker.
+        """
+
+        now = time.monotonic()
+        for index, requests in list(self._requests.items()):
+            if requests and now >= requests[0][1]:
+                logger.warning('Worker %d did not answer on its control channel, replacing it',
+                               self.table.get(index, PID))
+                self._close_control(index)
+                if self.table.get(index, STATE) == RUNNING:
+                    self._drain(index, now)
+
+    def _forward(self, signum, frame):
+        """Signal handler that passes the signal on to all workers."""
+
+        for index in self.table.indices(RUNNING) + self.table.indices(DRAINING):
+            try:
+                os.kill(self.table.get(index, PID), signum)
+            except ProcessLookupError:
+                pass
+
+    def _clear_wakeup(self):
+        """Empties the wakeup pipe after the loop was woken up."""
+
+        try:
+            while os.read(self._wakeup[0], 512):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _sample(self, now):
+        """Samples the load of the running workers and lets the autoscaler act on it.
+
+        Args:
+            now (float):
+                Monotonic timestamp of the sample.
+        """
+
+        running = self.table.indices(RUNNING)
+        cpu = 0.0
+        queue_length = 0
+        in_flight = 0
+        requests = 0
+
+        # Draining workers are part of the history, but not of the load
+        for index in running + self.table.indices(DRAINING):
+            usage = procstat.read_usage(self.table.get(index, PID))
+            if usage is None:
+                continue
+
+            previous = self.history.latest(index)
+            self.history.record(index, (now,) + usage)
+            if index not in running:
+                continue
+
+            # Utilisation is the CPU time consumed since the last sample,
+            # relative to the wall clock time that passed
+            if previous and now > previous[TIME]:
+                cpu += (usage[0] - previous[CPU]) / (now - previous[TIME])
+
+            queue_length += self.table.get(index, QUEUE_LENGTH)
+            in_flight += self.table.get(index, IN_FLIGHT)
+            requests += self.table.get(index, REQUESTS) + self.table.get(index, DISPATCHED)
+
+        backlog = sum(procstat.read_listen_backlog(sock) for sock in self.sockets)
+        workers = max(len(running), 1)
+
+        if self._parked:
+            return
+
+        # The amount of workers is fixed while a rolling restart is in progress,
+        # or while workers that exited unexpectedly wait to be replaced
+        if self._rollout or now < self._respawn_at:
+            return
+
+        # Anything going on, or any request or connection dispatched since
+        # the last sample, counts as activity
+        active = cpu > self.service.idle_cpu or backlog or queue_length or in_flight or \
+                 requests != self._last_requests
+        self._last_requests = requests
+
+        if active:
+            self._last_activity = now
+        elif self.service.idle_timeout and now - self._last_activity >= self.service.idle_timeout:
+            self._park('idle for %d seconds' % (now - self._last_activity))
+            return
+
+        self.target = self.autoscaler.decide(now, len(running), cpu / workers,
+                                             backlog, queue_length / workers)
+
+        if self.target == 0:
+            self._park('scaled down to zero workers')
+
+    def _reconcile(self, now):
+        """Spawns or drains workers until the amount of running workers matches the target.
+
+        Args:
+            now (float):
+                Monotonic timestamp, used to calculate drain deadlines.
+        """
+
+        if self._rollout:
+            return
+
+        running = self.table.indices(RUNNING)
+
+        # Replacing workers that exited unexpectedly waits for the respawn delay
+        while len(running) < self.target and now >= self._respawn_at:
+            index = self._spawn(execute=self._exec_workers)
+            if index is None:
+                break
+            running.append(index)
+
+        # Drain the workers with the least amount of queued work first
+        running.sort(key=lambda index: self.table.get(index, QUEUE_LENGTH))
+        for index in running[:max(len(running) - self.target, 0)]:
+            self._drain(index, now)
+
+    def _spawn(self, execute=False):
+        """Forks a new worker.
+
+        Args:
+            execute (bool):
+                True to execute the service again in the new worker, which loads
+                the code from disk, rather than running the code of the supervisor.
+
+        Returns:
+            The index of the slot of the new worker, or None when no worker
+            could be spawned.
+        """
+
+        index = self.table.acquire()
+        if index is None:
+            logger.warning('Unable to spawn a worker, all slots are in use')
+            return None
+
+        self.history.clear(index)
+
+        # Channel over which the supervisor sends requests to the worker
+        control, worker_control = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        # Channel over which connections are passed to the worker
+        channel = None
+        worker_channel = None
+        if self.service.dispatch:
+            channel, worker_channel = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            channel.setblocking(False)
+            worker_channel.setblocking(False)
+
+        try:
+            pid = os.fork()
+        except OSError as error:
+            logger.error('Unable to fork a worker: %s', error)
+            self.table.release(index)
+            control.close()
+            worker_control.close()
+            if channel:
+                channel.close()
+                worker_channel.close()
+            return None
+
+        if pid == 0:
+            control.close()
+            if channel:
+                channel.close()
+            if execute:
+                self._execute_worker(index, worker_control, worker_channel)
+            self.service.dispatch_channel = worker_channel
+            self._run_worker(index, worker_control)
+
+        worker_control.close()
+        if channel:
+            worker_channel.close()
+            self._channels[index] = channel
+
+        control = JsonChannel(control, lambda channel, reply: self._handle_reply(index, reply),
+                              lambda channel: self._selector.unregister(channel))
+        self._selector.register(control, selectors.EVENT_READ, control.handle_readable)
+        self._controls[index] = control
+
+        self.table.set(index, PID, pid)
+        logger.info('Spawned worker %d (slot %d)', pid, index)
+        return index
+
+    def _run_worker(self, index, control):
+        """Runs the service in a freshly forked worker process, never returns.
+
+        Args:
+            index (int):
+                The index of the slot of this worker.
+            control (socket.socket):
+                The worker's end of its control channel.
+        """
+
+        # Undo the signal handling of the supervisor, SIGTERM means
+        # that this worker is being drained
+        signal.set_wakeup_fd(-1)
+        self._selector.close()
+        for fd in self._wakeup:
+            os.close(fd)
+
+        # The worker only needs its own end of its own channels
+        for channel in self._channels.values():
+            channel.close()
+        for channel in self._controls.values():
+            channel.sock.close()
+        if self._control:
+            self._control.detach()
+
+        if self.service.dispatch:
+            for sock in self.sockets:
+                sock.close()
+
+        run_worker(self.service, self.table, index, control)
+
+    def _execute_worker(self, index, control, channel):
+        """Replaces a freshly forked worker process by a new run of the service, never returns.
+
+        The new process inherits the worker table, its channels and the listening
+        sockets, and finds their file descriptors in `WORKER_ENVIRONMENT`.
+
+        Args:
+            index (int):
+                The index of the slot of this worker.
+            control (socket.socket):
+                The worker's end of its control channel.
+            channel (socket.socket):
+                The worker's end of its dispatch channel, or None.
+        """
+
+        sockets = [] if self.service.dispatch else [sock.fileno() for sock in self.sockets]
+        worker = {
+            'table': self.table.fd,
+            'size': self.table.size,
+            'index': index,
+            'control': control.fileno(),
+            'channel': channel.fileno() if channel else None,
+            'sockets': sockets,
+            'config': self.service.config
+        }
+
+        for fd in [self.table.fd, control.fileno()] + sockets + ([channel.fileno()] if channel else []):
+            os.set_inheritable(fd, True)
+
+        os.environ[WORKER_ENVIRONMENT] = json.dumps(worker)
+
+        # Start the service the same way the supervisor was started
+        argv = getattr(sys, 'orig_argv', [sys.executable] + sys.argv)
+        argv = argv[:len(argv) - len(sys.argv) + 1] + ['--worker']
+
+        try:
+            os.execv(sys.executable, argv)
+        except OSError:
+            traceback.print_exc()
+            os._exit(1)
+
+    def _drain(self, index, now):
+        """Asks the worker in the specified slot to finish up and exit.
+
+        Args:
+            index (int):
+                The index of the slot of the worker to drain.
+            now (float):
+                Monotonic timestamp, used to calculate the drain deadline.
+        """
+
+        pid = self.table.get(index, PID)
+        self.table.set(index, STATE, DRAINING)
+        self._drain_deadlines[pid] = now + self.service.drain_timeout
+        logger.info('Draining worker %d (slot %d)', pid, index)
+
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def _enforce_drain_deadlines(self):
+        """Kills draining workers that did not exit before their deadline."""
+
+        now = time.monotonic()
+        for pid, deadline in self._drain_deadlines.items():
+            if now >= deadline:
+                logger.warning('Worker %d did not drain in time, killing it', pid)
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+    def _reap(self):
+        """Collects the exit status of all workers that exited and frees their slots."""
+
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+
+            if pid == 0:
+                return
+
+            self._drain_deadlines.pop(pid, None)
+
+            index = self.table.find(pid)
+            if index is None:
+                continue
+
+            code = os.waitstatus_to_exitcode(status)
+            if self.table.get(index, STATE) == RUNNING:
+                logger.warning('Worker %d exited unexpectedly with status %d', pid, code)
+                self._crashed(time.monotonic())
+            elif code != 0:
+                logger.warning('Worker %d exited with status %d while draining', pid, code)
+                if self._stopping:
+                    self.exit_status = 1
+
+            channel = self._channels.pop(index, None)
+            if channel:
+                channel.close()
+
+            # Free the slot first, the callbacks of the outstanding
+            # requests must not act on a worker that exited
+            self.table.release(index)
+            self._close_control(index)
+
+    def _crashed(self, now):
+        """Delays spawning a replacement after a worker exited unexpectedly, or stops
+        when too many workers exited unexpectedly within `crash_window` seconds.
+
+        Args:
+            now (float):
+                Monotonic timestamp of the unexpected exit.
+        """
+
+        self.crashes += 1
+        if self._stopping:
+            return
+
+        self._crash_times.append(now)
+        while now - self._crash_times[0] > self.service.crash_window:
+            self._crash_times.popleft()
+
+        if len(self._crash_times) >= self.service.max_crashes:
+            logger.error('%d workers exited unexpectedly within %d seconds, stopping',
+                         len(self._crash_times), self.service.crash_window)
+            self.exit_status = 1
+            self._stopping = True
+            return
+
+        delay = min(self.service.respawn_delay * 2 ** (len(self._crash_times) - 1),
+                    self.service.max_respawn_delay)
+        logger.info('Not replacing workers for %.1f seconds', delay)
+        self._respawn_at = now + delay
+
+def run_worker(service, table, index, control):
+    """Runs the service in a worker process, never returns.
+
+    Args:
+        service (PyService):
+            The service to run.
+        table (WorkerTable):
+            The worker table of the supervisor.
+        index (int):
+            The index of the slot of this worker.
+        control (socket.socket):
+            The worker's end of its control channel.
+    """
+
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, service._terminate)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    for signum in FORWARDED_SIGNALS:
+        signal.signal(signum, signal.SIG_DFL)
+
+    # A Ctrl+C in a terminal reaches the whole process group, leave
+    # it up to the supervisor to drain the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    table.set(index, PID, os.getpid())
+    service.worker_slot = WorkerSlot(table, index)
+
+    if service.ready_on_start:
+        table.set(index, READY, 1)
+
+    serve_channel(control, service._control)
+
+    # Never return into the supervisor's code, and never run the
+    # atexit handlers that were registered for the supervisor
+    code = 0
+    try:
+        service.started()
+    except SystemExit as error:
+        code = error.code if isinstance(error.code, int) else 0
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        try:
+            service._shutdown()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+def run_executed_worker(service, worker):
+    """Runs the service in a worker the supervisor executed, never returns.
+
+    Args:
+        service (PyService):
+            The service to run.
+        worker (dict):
+            The description of the worker the supervisor passed in `WORKER_ENVIRONMENT`.
+    """
+
+    table = WorkerTable(worker['size'], worker['table'])
+
+    if worker['channel'] is not None:
+        service.dispatch_channel = socket.socket(fileno=worker['channel'])
+
+    service.sockets = [socket.socket(fileno=fd) for fd in worker['sockets']]
+    run_worker(service, table, worker['index'], socket.socket(fileno=worker['control']))
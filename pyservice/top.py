@@ -0,0 +1,104 @@
+######################################################################################
+#
+#   This file is part of PyService.
+#
+#   PyService is free software: you can redistribute it and/or modify it under the
+#   terms of the GNU General Public License as published by the Free Software
+#   Foundation, version 2.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#   FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#   details.
+#
+#   You should have received a copy of the GNU General Public License along with
+#   this program; if not, write to the Free Software Foundation, Inc., 51
+#   Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#   Copyright: Swen Kooij (Photonios) <photonios@outlook.com>
+#
+#####################################################################################
+
+# Characters of a sparkline, from low to high
+SPARKS = ' ▁▂▃▄▅▆▇█'
+
+# Amount of samples shown in a sparkline
+SPARKLINE_WIDTH = 20
+
+def sparkline(values, low=None, high=None):
+    """Draws values as a line of block characters.
+
+    Args:
+        values (list):
+            The values to draw, the last `SPARKLINE_WIDTH` are drawn.
+        low (float):
+            The value drawn as the lowest block, by default the lowest value.
+        high (float):
+            The value drawn as the highest block, by default the highest value.
+
+    Returns:
+        The sparkline, `SPARKLINE_WIDTH` characters wide.
+    """
+
+    values = values[-SPARKLINE_WIDTH:]
+    if not values:
+        return ' ' * SPARKLINE_WIDTH
+
+    low = min(values) if low is None else low
+    high = max(values) if high is None else max(high, max(values))
+    scale = (len(SPARKS) - 2) / (high - low) if high > low else 0
+
+    # Even the lowest value gets a block, so the line shows where there are samples
+    line = ''.join(SPARKS[1 + int((value - low) * scale)] for value in values)
+    return line.rjust(SPARKLINE_WIDTH)
+
+def format_bytes(amount):
+    """Formats an amount of bytes with a unit, for example 1.5M."""
+
+    for unit in ('', 'K', 'M', 'G'):
+        if abs(amount) < 1024:
+            break
+        amount /= 1024.0
+    else:
+        unit = 'T'
+
+    return '%.0f%s' % (amount, unit) if not unit else '%.1f%s' % (amount, unit)
+
+def render(top):
+    """Renders the reply to a `top` command as a table with a row per worker.
+
+    Args:
+        top (dict):
+            The reply of the supervisor.
+
+    Returns:
+        The table, as text.
+    """
+
+    lines = [
+        '%s: %d workers, sampled every %gs' % (top['name'], len(top['workers']), top['interval']),
+        '',
+        '%4s %7s %-8s %6s %8s %8s %5s %8s %8s  %-*s  %-*s' % (
+            'SLOT', 'PID', 'STATE', 'CPU', 'RSS', 'CSW/s', 'FDS', 'READ/s', 'WRITE/s',
+            SPARKLINE_WIDTH, 'CPU', SPARKLINE_WIDTH, 'RSS')
+    ]
+
+    for worker in top['workers']:
+        usage = worker['usage']
+        row = '%4d %7d %-8s ' % (worker['slot'], worker['pid'], worker['state'])
+
+        if not usage:
+            lines.append(row + '%6s' % '-')
+            continue
+
+        cpu, rss, context_switches, fds, read, written = usage[-1]
+        row += '%5.1f%% %8s %8.0f %5d %8s %8s  ' % (
+            cpu * 100, format_bytes(rss), context_switches, fds, format_bytes(read), format_bytes(written))
+
+        # CPU is drawn relative to one full CPU, RSS relative to its own range
+        # so that growth stands out
+        row += sparkline([sample[0] for sample in usage], 0, 1) + '  '
+        row += sparkline([sample[1] for sample in usage])
+        lines.append(row)
+
+    return '\n'.join(lines) + '\n'
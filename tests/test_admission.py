@@ -0,0 +1,141 @@
+######################################################################################
+#
+#   This file is part of PyService.
+#
+#   PyService is free software: you can redistribute it and/or modify it under the
+#   terms of the GNU General Public License as published by the Free Software
+#   Foundation, version 2.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#   FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#   details.
+#
+#   You should have received a copy of the GNU General Public License along with
+#   this program; if not, write to the Free Software Foundation, Inc., 51
+#   Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#   Copyright: Swen Kooij (Photonios) <photonios@outlook.com>
+#
+#####################################################################################
+
+import asyncio
+import threading
+import unittest
+
+from pyservice.admission import AdmissionController, FixedLimit, AIMDLimit, GradientLimit
+from pyservice.exceptions import OverloadedError
+
+class TestLimits(unittest.TestCase):
+
+    def test_fixed_limit_never_changes(self):
+        limit = FixedLimit(4)
+        limit.update(10.0, 4, True)
+        self.assertEqual(limit.limit, 4)
+
+    def test_aimd_grows_when_used_and_backs_off_when_slow(self):
+        limit = AIMDLimit(initial=10, latency_threshold=1.0)
+        limit.update(0.1, 10, False)
+        self.assertEqual(limit.limit, 11)
+
+        limit.update(2.0, 10, False)
+        self.assertEqual(limit.limit, 9)
+
+    def test_aimd_does_not_grow_when_idle(self):
+        limit = AIMDLimit(initial=10)
+        limit.update(0.1, 1, False)
+        self.assertEqual(limit.limit, 10)
+
+    def test_gradient_shrinks_when_latency_rises(self):
+        limit = GradientLimit(initial=100)
+        for _ in range(50):
+            limit.update(0.01, limit.limit, False)
+        grown = limit.limit
+
+        for _ in range(20):
+            limit.update(1.0, limit.limit, False)
+        self.assertLess(limit.limit, grown)
+
+    def test_gradient_stays_within_bounds(self):
+        limit = GradientLimit(initial=10, minimum=5, maximum=20)
+        for _ in range(200):
+            limit.update(0.01, 20, False)
+        self.assertEqual(limit.limit, 20)
+
+        for _ in range(200):
+            limit.update(0.01, 20, True)
+        self.assertEqual(limit.limit, 5)
+
+class TestAdmissionController(unittest.TestCase):
+
+    def test_admits_up_to_the_limit_then_queues(self):
+        admission = AdmissionController(FixedLimit(1), queue_timeout=5.0)
+        admission.acquire()
+
+        admitted = threading.Event()
+        thread = threading.Thread(target=lambda: (admission.acquire(), admitted.set()))
+        thread.start()
+
+        self.assertFalse(admitted.wait(0.1))
+        admission.release(0.01)
+        self.assertTrue(admitted.wait(1.0))
+        thread.join()
+        self.assertEqual(admission.stats()['in_flight'], 1)
+
+    def test_rejects_when_queue_is_full(self):
+        admission = AdmissionController(FixedLimit(1), max_queue=0)
+        admission.acquire()
+
+        with self.assertRaises(OverloadedError):
+            admission.acquire()
+        self.assertEqual(admission.stats()['rejected'], 1)
+
+    def test_rejects_after_queue_timeout(self):
+        admission = AdmissionController(FixedLimit(1), queue_timeout=0.05)
+        admission.acquire()
+
+        with self.assertRaises(OverloadedError):
+            admission.acquire()
+        self.assertEqual(admission.stats()['waiting'], 0)
+
+    def test_cancelled_waiter_is_removed_from_the_queue(self):
+        admission = AdmissionController(FixedLimit(1), queue_timeout=5.0)
+
+        async def scenario():
+            await admission.acquire_async()
+            waiter = asyncio.ensure_future(admission.acquire_async())
+            await asyncio.sleep(0.01)
+            waiter.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+
+            admission.release(0.01)
+            self.assertEqual(admission.stats()['in_flight'], 0)
+
+            # The service still admits requests afterwards
+            await asyncio.wait_for(admission.acquire_async(), 1.0)
+
+        asyncio.run(scenario())
+        self.assertEqual(admission.stats()['waiting'], 0)
+
+    def test_cancelled_waiter_gives_back_its_slot_when_already_admitted(self):
+        admission = AdmissionController(FixedLimit(1), queue_timeout=5.0)
+
+        async def scenario():
+            await admission.acquire_async()
+            waiter = asyncio.ensure_future(admission.acquire_async())
+            await asyncio.sleep(0.01)
+
+            # Admitted by the release, cancelled before it got to run
+            admission.release(0.01)
+            waiter.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+
+            self.assertEqual(admission.stats()['in_flight'], 0)
+            await asyncio.wait_for(admission.acquire_async(), 1.0)
+
+        asyncio.run(scenario())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+######################################################################################
+#
+#   This file is part of PyService.
+#
+#   PyService is free software: you can redistribute it and/or modify it under the
+#   terms of the GNU General Public License as published by the Free Software
+#   Foundation, version 2.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#   FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#   details.
+#
+#   You should have received a copy of the GNU General Public License along with
+#   this program; if not, write to the Free Software Foundation, Inc., 51
+#   Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#   Copyright: Swen Kooij (Photonios) <photonios@outlook.com>
+#
+#####################################################################################
+
+import unittest
+
+from pyservice.autoscaler import Autoscaler
+
+class TestAutoscaler(unittest.TestCase):
+
+    def setUp(self):
+        self.autoscaler = Autoscaler(1, 4, scale_up_samples=3, scale_down_samples=3,
+                                     scale_up_cooldown=10.0, scale_down_cooldown=60.0)
+
+    def test_invalid_bounds(self):
+        self.assertRaises(ValueError, Autoscaler, 3, 2)
+        self.assertRaises(ValueError, Autoscaler, 1, 2, scale_up_cpu=0.5, scale_down_cpu=0.5)
+
+    def test_enforces_bounds(self):
+        self.assertEqual(self.autoscaler.decide(0, 0, 0.0, 0, 0), 1)
+        self.assertEqual(self.autoscaler.decide(1, 6, 1.0, 100, 100), 4)
+
+    def test_scales_up_after_consecutive_samples(self):
+        self.assertEqual(self.autoscaler.decide(0, 2, 0.9, 0, 0), 2)
+        self.assertEqual(self.autoscaler.decide(1, 2, 0.9, 0, 0), 2)
+        self.assertEqual(self.autoscaler.decide(2, 2, 0.9, 0, 0), 3)
+
+    def test_single_sample_resets_count(self):
+        self.autoscaler.decide(0, 2, 0.9, 0, 0)
+        self.autoscaler.decide(1, 2, 0.9, 0, 0)
+        self.autoscaler.decide(2, 2, 0.5, 0, 0)
+        self.assertEqual(self.autoscaler.decide(3, 2, 0.9, 0, 0), 2)
+
+    def test_backlog_and_queue_scale_up(self):
+        for now in range(3):
+            target = self.autoscaler.decide(now, 2, 0.0, 9, 0)
+        self.assertEqual(target, 3)
+
+        autoscaler = Autoscaler(1, 4, scale_up_samples=1)
+        self.assertEqual(autoscaler.decide(0, 2, 0.0, 0, 17), 3)
+
+    def test_cooldown(self):
+        for now in range(3):
+            self.autoscaler.decide(now, 2, 0.9, 0, 0)
+
+        # Overloaded again, but still cooling down from scaling up at 2
+        for now in range(3, 6):
+            self.assertEqual(self.autoscaler.decide(now, 3, 0.9, 0, 0), 3)
+        self.assertEqual(self.autoscaler.decide(12, 3, 0.9, 0, 0), 4)
+
+    def test_scales_down_when_idle(self):
+        for now in range(3):
+            self.assertEqual(self.autoscaler.decide(now, 2, 0.1, 0, 0), 2 if now < 2 else 1)
+
+        # Never below the minimum
+        for now in range(100, 110):
+            self.assertEqual(self.autoscaler.decide(now, 1, 0.0, 0, 0), 1)
+
+    def test_hysteresis(self):
+        # Between the thresholds, nothing happens
+        for now in range(100):
+            self.assertEqual(self.autoscaler.decide(now, 2, 0.5, 0, 0), 2)
+
+        # Any backlog prevents scaling down
+        for now in range(100, 200):
+            self.assertEqual(self.autoscaler.decide(now, 2, 0.0, 1, 0), 2)
+
+if __name__ == '__main__':
+    unittest.main()
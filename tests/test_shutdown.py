@@ -0,0 +1,98 @@
+######################################################################################
+#
+#   This file is part of PyService.
+#
+#   PyService is free software: you can redistribute it and/or modify it under the
+#   terms of the GNU General Public License as published by the Free Software
+#   Foundation, version 2.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#   FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#   details.
+#
+#   You should have received a copy of the GNU General Public License along with
+#   this program; if not, write to the Free Software Foundation, Inc., 51
+#   Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#   Copyright: Swen Kooij (Photonios) <photonios@outlook.com>
+#
+#####################################################################################
+
+import time
+import unittest
+import threading
+
+from pyservice.shutdown import ShutdownRegistry
+
+class TestShutdownRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = ShutdownRegistry()
+        self.calls = []
+
+    def record(self, name, delay=0.0):
+        def hook():
+            time.sleep(delay)
+            self.calls.append(name)
+        return hook
+
+    def test_runs_dependencies_first(self):
+        self.registry.register('database', self.record('database'), after=['server'])
+        self.registry.register('server', self.record('server', 0.1))
+        self.registry.register('cache', self.record('cache'), after=['server', 'database'])
+
+        results = self.registry.run()
+        self.assertEqual(self.calls, ['server', 'database', 'cache'])
+        self.assertEqual(results, {'server': 'ok', 'database': 'ok', 'cache': 'ok'})
+
+    def test_runs_independent_hooks_concurrently(self):
+        for name in ('a', 'b', 'c'):
+            self.registry.register(name, self.record(name, 0.2))
+
+        start = time.monotonic()
+        self.registry.run()
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(sorted(self.calls), ['a', 'b', 'c'])
+
+    def test_only_runs_once(self):
+        self.registry.register('a', self.record('a'))
+        self.registry.run()
+        self.assertEqual(self.registry.run(), {})
+        self.assertEqual(self.calls, ['a'])
+
+    def test_failed_hook(self):
+        def fail():
+            raise RuntimeError('failed')
+
+        self.registry.register('a', fail)
+        self.registry.register('b', self.record('b'), after=['a'])
+
+        self.assertEqual(self.registry.run(), {'a': 'failed', 'b': 'ok'})
+
+    def test_overrun_hook_does_not_block_dependents(self):
+        release = threading.Event()
+        self.registry.register('slow', release.wait, deadline=0.1)
+        self.registry.register('b', self.record('b'), after=['slow'])
+
+        start = time.monotonic()
+        results = self.registry.run()
+        release.set()
+
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertEqual(results, {'slow': 'overrun', 'b': 'ok'})
+
+    def test_cycle_is_skipped(self):
+        self.registry.register('a', self.record('a'), after=['b'])
+        self.registry.register('b', self.record('b'), after=['a'])
+        self.registry.register('c', self.record('c'), after=['missing'])
+
+        self.assertEqual(self.registry.run(), {'a': 'skipped', 'b': 'skipped', 'c': 'ok'})
+        self.assertEqual(self.calls, ['c'])
+
+    def test_duplicate_name(self):
+        self.registry.register('a', self.record('a'))
+        self.assertRaises(ValueError, self.registry.register, 'a', self.record('a'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+######################################################################################
+#
+#   This file is part of PyService.
+#
+#   PyService is free software: you can redistribute it and/or modify it under the
+#   terms of the GNU General Public License as published by the Free Software
+#   Foundation, version 2.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#   FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#   details.
+#
+#   You should have received a copy of the GNU General Public License along with
+#   this program; if not, write to the Free Software Foundation, Inc., 51
+#   Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#   Copyright: Swen Kooij (Photonios) <photonios@outlook.com>
+#
+#####################################################################################
+
+import os
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+
+from pyservice.state import StateStore
+
+def save_repeatedly(directory, value):
+    """Saves the same snapshot many times, returns the amount of failed saves."""
+
+    store = StateStore(directory)
+    failures = 0
+    for _ in range(100):
+        try:
+            store.save('shared', bytes([value]) * 1000)
+        except OSError:
+            failures += 1
+    return failures
+
+class TestStateStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_save_and_load(self):
+        store = StateStore(self.directory)
+        store.save('counters', b'hello')
+        self.assertEqual(bytes(store.load('counters')), b'hello')
+        store.close()
+
+    def test_discards_other_schema_version(self):
+        StateStore(self.directory, schema_version=1).save('counters', b'hello')
+        self.assertIsNone(StateStore(self.directory, schema_version=2).load('counters'))
+
+    def test_concurrent_saves_of_the_same_snapshot(self):
+        with multiprocessing.Pool(4) as pool:
+            failures = pool.starmap(save_repeatedly, [(self.directory, value) for value in range(4)])
+
+        self.assertEqual(failures, [0, 0, 0, 0])
+
+        store = StateStore(self.directory)
+        data = bytes(store.load('shared'))
+        store.close()
+
+        # One writer's snapshot, complete, and every save got its own generation
+        self.assertEqual(len(set(data)), 1)
+        self.assertEqual(store._read_generation(store._path('shared')), 400)
+        self.assertEqual([path for path in os.listdir(self.directory) if path.endswith('.tmp')], [])
+
+    def test_only_the_owner_can_write(self):
+        directory = os.path.join(self.directory, 'state')
+
+        # Daemons run without a umask
+        umask = os.umask(0)
+        try:
+            StateStore(directory).save('counters', b'hello')
+        finally:
+            os.umask(umask)
+
+        self.assertEqual(os.stat(directory).st_mode & 0o777, 0o700)
+        for path in os.listdir(directory):
+            self.assertEqual(os.stat(os.path.join(directory, path)).st_mode & 0o777, 0o600)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+######################################################################################
+#
+#   This file is part of PyService.
+#
+#   PyService is free software: you can redistribute it and/or modify it under the
+#   terms of the GNU General Public License as published by the Free Software
+#   Foundation, version 2.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#   FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#   details.
+#
+#   You should have received a copy of the GNU General Public License along with
+#   this program; if not, write to the Free Software Foundation, Inc., 51
+#   Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#   Copyright: Swen Kooij (Photonios) <photonios@outlook.com>
+#
+#####################################################################################
+
+import sys
+import time
+import signal
+import subprocess
+import unittest
+
+from pyservice.subprocesses import SubprocessPool
+
+def python(code):
+    """Gets the arguments to run a snippet of Python code in a child process."""
+
+    return [sys.executable, '-c', code]
+
+SLEEP = python('import time; time.sleep(30)')
+
+# Ignores SIGTERM, announces that on stdout and sleeps
+STUBBORN = python('import signal, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); '
+                  'print("ready", flush=True); time.sleep(30)')
+
+class TestSubprocessPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = SubprocessPool(max_concurrency=2, kill_timeout=0.5)
+        self.finished = []
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_queues_above_max_concurrency(self):
+        first = self.pool.spawn(python('import time; time.sleep(0.3)'))
+        second = self.pool.spawn(python('import time; time.sleep(0.3)'))
+        third = self.pool.spawn(python('pass'), callback=self.finished.append)
+
+        self.assertEqual(self.pool.running, 2)
+        self.assertEqual(self.pool.pending, 1)
+        self.assertIsNone(third.pid)
+
+        self.assertEqual(third.wait(5), 0)
+        self.assertEqual(self.finished, [third])
+        self.assertTrue(first.done() and second.done())
+        self.assertEqual(self.pool.pending, 0)
+
+    def test_timeout_escalates_to_sigkill(self):
+        managed = self.pool.spawn(STUBBORN, timeout=0.5, stdout=subprocess.PIPE)
+        self.assertEqual(managed.process.stdout.readline(), b'ready\n')
+
+        start = time.monotonic()
+        self.assertEqual(managed.wait(5), -signal.SIGKILL)
+        managed.process.stdout.close()
+
+        self.assertTrue(managed.timed_out)
+        self.assertLess(time.monotonic() - start, 3)
+
+    def test_close_stops_running_and_cancels_queued(self):
+        running = [self.pool.spawn(SLEEP, callback=self.finished.append) for _ in range(2)]
+        queued = self.pool.spawn(SLEEP, callback=self.finished.append)
+
+        start = time.monotonic()
+        self.pool.close()
+        self.assertLess(time.monotonic() - start, 3)
+
+        for managed in running:
+            self.assertTrue(managed.done())
+            self.assertEqual(managed.returncode, -signal.SIGTERM)
+
+        self.assertTrue(queued.done())
+        self.assertIsNone(queued.process)
+        self.assertIsNone(queued.returncode)
+        self.assertCountEqual(self.finished, running + [queued])
+
+        self.assertRaises(RuntimeError, self.pool.spawn, SLEEP)
+
+    def test_close_kills_children_ignoring_sigterm(self):
+        managed = self.pool.spawn(STUBBORN, stdout=subprocess.PIPE)
+        self.assertEqual(managed.process.stdout.readline(), b'ready\n')
+
+        self.pool.close()
+        managed.process.stdout.close()
+        self.assertEqual(managed.returncode, -signal.SIGKILL)
+
+    def test_callback_on_spawn_failure(self):
+        managed = self.pool.spawn(['/nonexistent/program'], callback=self.finished.append)
+
+        self.assertTrue(managed.done())
+        self.assertEqual(managed.returncode, -1)
+        self.assertEqual(self.finished, [managed])
+        self.assertEqual(self.pool.running, 0)
+
+if __name__ == '__main__':
+    unittest.main()
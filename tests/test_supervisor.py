@@ -0,0 +1,241 @@
+######################################################################################
+#
+#   This file is part of PyService.
+#
+#   PyService is free software: you can redistribute it and/or modify it under the
+#   terms of the GNU General Public License as published by the Free Software
+#   Foundation, version 2.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#   FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#   details.
+#
+#   You should have received a copy of the GNU General Public License along with
+#   this program; if not, write to the Free Software Foundation, Inc., 51
+#   Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#   Copyright: Swen Kooij (Photonios) <photonios@outlook.com>
+#
+#####################################################################################
+
+import os
+import socket
+import selectors
+import unittest
+
+from pyservice.autoscaler import Autoscaler
+from pyservice.supervisor import PyServiceSupervisor, RUNNING, PID
+from pyservice import procstat
+
+class Service(object):
+    """The attributes of a PyService the supervisor uses, without its command line handling."""
+
+    name = 'test'
+    min_workers = 0
+    max_workers = 2
+    listen = [('127.0.0.1', 0), ('127.0.0.1', 0)]
+    listen_backlog = 8
+    dispatch = False
+    idle_timeout = 1.0
+    history_length = 10
+    control_socket = None
+    respawn_delay = 0.5
+    max_respawn_delay = 2.0
+    max_crashes = 5
+    crash_window = 60.0
+
+    def __init__(self):
+        self.config = {}
+
+    def create_autoscaler(self):
+        return Autoscaler(self.min_workers, self.max_workers)
+
+    def validate_config(self, config):
+        pass
+
+    def _apply_builtin_config(self, config):
+        pass
+
+class Channel(object):
+    """Control channel of a worker that records the requests sent to it."""
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, request):
+        self.sent.append(request)
+
+    def close(self):
+        pass
+
+class TestParkedSupervisor(unittest.TestCase):
+
+    def setUp(self):
+        self.supervisor = PyServiceSupervisor(Service())
+        self.supervisor.sockets = [self.supervisor._bind(address) for address in Service.listen]
+
+        self.supervisor._wakeup = os.pipe()
+        self.supervisor._selector = selectors.DefaultSelector()
+        self.supervisor._selector.register(self.supervisor._wakeup[0], selectors.EVENT_READ)
+
+        # Claim slots instead of forking workers
+        self.spawned = []
+        def reconcile(now):
+            while len(self.supervisor.table.indices(RUNNING)) < self.supervisor.target:
+                index = self.supervisor.table.acquire()
+                self.supervisor.table.set(index, PID, -1)
+                self.spawned.append(index)
+        self.supervisor._reconcile = reconcile
+
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        for sock in self.supervisor.sockets:
+            sock.close()
+        self.supervisor._selector.close()
+        for fd in self.supervisor._wakeup:
+            os.close(fd)
+
+    def connect(self, sock):
+        client = socket.create_connection(sock.getsockname())
+        self.clients.append(client)
+
+    def test_wakes_up_once_for_connections_on_multiple_sockets(self):
+        self.assertTrue(self.supervisor._parked)
+
+        for sock in self.supervisor.sockets:
+            self.connect(sock)
+
+        self.supervisor._poll(1.0)
+
+        self.assertFalse(self.supervisor._parked)
+        self.assertEqual(len(self.spawned), 1)
+
+        # The connections are left to the workers
+        for sock in self.supervisor.sockets:
+            self.assertEqual(procstat.read_listen_backlog(sock), 1)
+
+class TestCrashes(unittest.TestCase):
+
+    def setUp(self):
+        service = Service()
+        service.min_workers = 1
+        service.idle_timeout = None
+        self.supervisor = PyServiceSupervisor(service)
+
+        # Claim slots instead of forking workers
+        def spawn(execute=False):
+            index = self.supervisor.table.acquire()
+            self.supervisor.table.set(index, PID, -1)
+            return index
+        self.supervisor._spawn = spawn
+
+    def running(self):
+        return len(self.supervisor.table.indices(RUNNING))
+
+    def crash(self, now):
+        index = self.supervisor.table.indices(RUNNING)[0]
+        self.supervisor.table.release(index)
+        self.supervisor._crashed(now)
+
+    def test_respawn_delay_grows(self):
+        self.supervisor._reconcile(0)
+        self.assertEqual(self.running(), 1)
+
+        self.crash(0)
+        self.supervisor._reconcile(0.4)
+        self.assertEqual(self.running(), 0)
+        self.supervisor._reconcile(0.5)
+        self.assertEqual(self.running(), 1)
+
+        self.crash(1)
+        self.supervisor._reconcile(1.9)
+        self.assertEqual(self.running(), 0)
+        self.supervisor._reconcile(2)
+        self.assertEqual(self.running(), 1)
+
+        # Never longer than the maximum
+        self.crash(2)
+        self.assertEqual(self.supervisor._respawn_at, 4)
+
+    def test_stops_after_too_many_crashes(self):
+        for now in range(5):
+            self.supervisor._reconcile(100 + now * 10)
+            self.crash(100 + now * 10)
+
+        self.assertEqual(self.supervisor.crashes, 5)
+        self.assertTrue(self.supervisor._stopping)
+        self.assertEqual(self.supervisor.exit_status, 1)
+
+    def test_crashes_outside_the_window_are_forgotten(self):
+        for now in range(10):
+            self.supervisor._reconcile(now * 20)
+            self.crash(now * 20)
+
+        self.assertEqual(self.supervisor.crashes, 10)
+        self.assertFalse(self.supervisor._stopping)
+        self.assertEqual(self.supervisor.exit_status, 0)
+
+class TestReconfigure(unittest.TestCase):
+
+    def setUp(self):
+        service = Service()
+        service.min_workers = 1
+        service.max_workers = 3
+        service.idle_timeout = None
+        service.config = {'version': 1}
+        self.supervisor = PyServiceSupervisor(service)
+
+        self.drained = []
+        self.supervisor._drain = lambda index, now: self.drained.append(index)
+
+        self.replies = []
+        self.workers = [self.spawn(1000), self.spawn(1001)]
+
+    def spawn(self, pid):
+        index = self.supervisor.table.acquire()
+        self.supervisor.table.set(index, PID, pid)
+        self.supervisor._controls[index] = Channel()
+        return index
+
+    def sent(self, index):
+        return self.supervisor._controls[index].sent
+
+    def answer(self, index, ok):
+        self.supervisor._handle_reply(index, {'ok': ok, 'error': None if ok else 'rejected'})
+
+    def test_pushes_committed_config_to_workers_spawned_meanwhile(self):
+        self.supervisor._reconfigure({'version': 2}, self.replies.append)
+        spawned = self.spawn(1002)
+
+        for index in self.workers:
+            self.answer(index, True)
+
+        self.assertEqual(self.replies, [{'ok': True}])
+        self.assertEqual(self.supervisor.service.config, {'version': 2})
+        self.assertEqual(self.sent(spawned), [{'command': 'reconfigure', 'config': {'version': 2}}])
+
+        # A new worker that rejects it is replaced
+        self.answer(spawned, False)
+        self.assertEqual(self.drained, [spawned])
+
+    def test_replaces_workers_that_fail_to_roll_back(self):
+        self.supervisor._reconfigure({'version': 2}, self.replies.append)
+        spawned = self.spawn(1002)
+
+        self.answer(self.workers[0], True)
+        self.answer(self.workers[1], False)
+
+        self.assertFalse(self.replies[0]['ok'])
+        self.assertEqual(self.supervisor.service.config, {'version': 1})
+        self.assertEqual(self.sent(self.workers[0])[-1], {'command': 'reconfigure', 'config': {'version': 1}})
+        self.assertEqual(self.sent(spawned), [])
+
+        self.answer(self.workers[0], False)
+        self.assertEqual(self.drained, [self.workers[0]])
+
+if __name__ == '__main__':
+    unittest.main()